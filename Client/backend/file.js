@@ -33,6 +33,12 @@ async function handleUpload(event, {fileName, fileType, fileBuffer, sid}) {
         });
         if (response.data.code==200){
             logger.info("Successfully ask KMS Public Key");
+            // Only RSA-OAEP wrapping is implemented here; ECIES keys need the envelope in key_algorithms.py
+            const algorithm = response.data.algorithm || 'rsa-2048';
+            if (algorithm !== 'rsa-2048') {
+                logger.error(`Unsupported key algorithm: ${algorithm}`);
+                return { success: false, error: `unsupported_algorithm: ${algorithm}` };
+            }
             let pubKey = response.data.kms_public_key;
 
             pubKey = Buffer.from(pubKey, 'base64').toString('utf-8');
@@ -66,7 +72,7 @@ async function handleUpload(event, {fileName, fileType, fileBuffer, sid}) {
                     encrypted_aes_key: encryptedKey, 
                     encrypted_aes_initial_vector: encryptedIV},
                     {
-                        headers: {'Content-Type': 'application/json'}
+                        headers: {'Content-Type': 'application/json', 'sid': sid}
                     });
                 console.log(response.data);
                 if (response.data.code==200){
@@ -104,20 +110,69 @@ async function handleUpload(event, {fileName, fileType, fileBuffer, sid}) {
     }
 }
 
-async function handleListFile(event) {
-    logger.info(`List File Attempt`);
+// Last full listing, kept current with /list_files?since=<version>
+let listCache = null;
 
-    try {
+async function fetchFullListing() {
+    // The listing is paginated; follow next_cursor until the last page
+    const files = new Set();
+    let cursor = null;
+    let version = null;
+    do {
         const response = await axios.get(`${dataBaseUrl}list_files`, {
+            params: { limit: 1000, ...(cursor ? { cursor } : {}) },
             headers: { 'Content-Type': 'application/json' }
         });
-        if (response.data.code === 200) {
-            logger.info("Successfully retrieved file list");
-            console.log(response.data.files);
-            return { success: true, files: response.data.files };
-        } else {
-            return { success: false, error: response.data.message };
+        if (response.data.code !== 200) {
+            throw new Error(response.data.message);
+        }
+        if (version === null) {
+            version = response.data.version;
+        }
+        response.data.files.forEach(name => files.add(name));
+        cursor = response.data.next_cursor;
+    } while (cursor);
+    return { version, files };
+}
+
+// Applies the changes since the cached version; false if a full listing is needed
+async function applyChanges(cache) {
+    let more = true;
+    while (more) {
+        const response = await axios.get(`${dataBaseUrl}list_files`, {
+            params: { since: cache.version, limit: 1000 },
+            headers: { 'Content-Type': 'application/json' }
+        });
+        if (response.data.code !== 200) {
+            throw new Error(response.data.message);
         }
+        if (response.data.reset) {
+            return false;
+        }
+        for (const change of response.data.changes) {
+            if (change.op === 'upload') {
+                cache.files.add(change.file);
+            } else if (change.op === 'delete') {
+                cache.files.delete(change.file);
+            }
+        }
+        cache.version = response.data.version;
+        more = response.data.more;
+    }
+    return true;
+}
+
+async function handleListFile(event) {
+    logger.info(`List File Attempt`);
+
+    try {
+        if (!listCache || !(await applyChanges(listCache))) {
+            listCache = await fetchFullListing();
+        }
+        const files = [...listCache.files].sort();
+        logger.info(`Successfully retrieved file list (version ${listCache.version})`);
+        console.log(files);
+        return { success: true, files };
     } catch (error) {
         logger.error("Failed to retrieve file list");
         if (axios.isAxiosError(error)) {
@@ -138,7 +193,7 @@ async function handleDownload(event, {fileName, sid, savePath}) {
         // Part 1: Download from data server 
        const response = await axios.get(`${dataBaseUrl}download`, {
         params: { file_name: fileName },
-        headers: { 'Content-Type': 'application/json' }
+        headers: { 'Content-Type': 'application/json', 'sid': sid }
         });
 
         if (response.data.code != 200) {
@@ -225,4 +280,45 @@ async function handleDownload(event, {fileName, sid, savePath}) {
     }
 }
 
-module.exports = { handleUpload, handleListFile, handleDownload };
\ No newline at end of file
+async function handleDelete(event, {fileName, sid}) {
+    logger.info(`Delete Attempt File: ${fileName}`);
+
+    try {
+        // Step 1: Delete from data server first; for files uploaded without a
+        // session it checks ownership against the KMS key pair removed in Step 2
+        const response = await axios.post(`${dataBaseUrl}delete_file`, { file_name: fileName }, {
+            headers: { 'Content-Type': 'application/json', 'sid': sid },
+            validateStatus: status => status < 500
+        });
+
+        // file_not_found: a previous attempt got this far, carry on with the keys
+        if (response.data.code != 200 && response.data.code != 404) {
+            return { success: false, error: response.data.message };
+        }
+        logger.info("Successfully delete file from data server");
+
+        // Step 2: Delete the key pair and its ACL on the KMS
+        const response2 = await axios.post(`${apiBaseUrl}delete_file`, { file_name: fileName }, {
+            headers: { 'Content-Type': 'application/json', 'sid': sid }
+        });
+
+        if (response2.data.code != 200) {
+            return { success: false, error: response2.data.message };
+        }
+
+        logger.info(`Successfully delete file: ${fileName}`);
+        return { success: true, fileName: fileName };
+
+    } catch (error) {
+        logger.error("Failed to delete file");
+        if (axios.isAxiosError(error)) {
+            console.error("Axios error:", error.response?.status, error.response?.data);
+            return { success: false, error: error.response?.data?.status || error.message };
+        } else {
+            console.error("Unexpected error:", error);
+            return { success: false, error: error.message };
+        }
+    }
+}
+
+module.exports = { handleUpload, handleListFile, handleDownload, handleDelete };
\ No newline at end of file
@@ -1,7 +1,7 @@
 const { app, BrowserWindow, ipcMain, dialog } = require('electron');
 const path = require('path');
 const { handleLogin, handleRegister, handleOTP, handleOTPRegister} = require('./backend/auth.js');
-const { handleUpload, handleListFile, handleDownload} = require('./backend/file.js');
+const { handleUpload, handleListFile, handleDownload, handleDelete} = require('./backend/file.js');
 const { handleGrantAccess } = require('./backend/grant.js');
 
 function createWindow() {
@@ -42,6 +42,7 @@ ipcMain.handle('otp_register', handleOTPRegister);
 ipcMain.handle('upload', handleUpload);
 ipcMain.handle('list_file', handleListFile);
 ipcMain.handle('download', handleDownload);
+ipcMain.handle('delete_file', handleDelete);
 
 // Grant Access
 ipcMain.handle('grant_access', handleGrantAccess);
@@ -8,5 +8,6 @@ contextBridge.exposeInMainWorld('electronAPI', {
   upload: (fileName, fileType, fileBuffer, sid) => ipcRenderer.invoke('upload', { fileName, fileType, fileBuffer, sid }),
   list_file: () => ipcRenderer.invoke('list_file'),
   download: (fileName, sid, savePath) => ipcRenderer.invoke('download', { fileName, sid, savePath }),
+  delete_file: (fileName, sid) => ipcRenderer.invoke('delete_file', { fileName, sid }),
   grant_access: (fileName, email, sid) => ipcRenderer.invoke('grant_access', { fileName, email, sid }),
 });
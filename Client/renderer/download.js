@@ -49,6 +49,30 @@ async function fetchFileList() {
                 grantTd.appendChild(grantBtn);
                 tr.appendChild(grantTd);
 
+                // Delete button column
+                const deleteTd = document.createElement("td");
+                const deleteBtn = document.createElement("button");
+                deleteBtn.textContent = "Delete";
+                deleteBtn.onclick = async () => {
+                    if (!confirm(`Delete ${file}?`)) {
+                        return;
+                    }
+                    const response = await window.electronAPI.delete_file(file, sid);
+
+                    const msg = document.getElementById("downloadMsg");
+                    if(response.success) {
+                        msg.innerHTML = `File ${file} deleted`;
+                        msg.style.color = "green";
+                        fetchFileList();
+                    }else{
+                        msg.innerHTML = response.error || "Delete failed!";
+                        msg.style.color = "red";
+                    }
+                };
+
+                deleteTd.appendChild(deleteBtn);
+                tr.appendChild(deleteTd);
+
                 tbody.appendChild(tr);
             });
         } else {
@@ -1,12 +1,25 @@
 # Data_Server_APIs_fastapi.py
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Header, Request
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import List, Optional
+from collections import OrderedDict, deque
 from dotenv import load_dotenv
+import asyncio
+import base64
+import binascii
+import hashlib
 import os
-import redis
+import tarfile
+import time
+import uuid
+from redis import asyncio as aioredis
 import logging
+from blob_store import BLOB_REFS, BLOB_STAGING, make_blob_store, manifest_digest
+from changelog import changelog_lua, changes_since, current_version
+from codec import JSONResponse, Negotiation, current_codec
+from session_tokens import SessionTokens
 
 # === Logging ===
 logging.basicConfig(
@@ -21,7 +34,75 @@ def log(msg: str):
 
 # === Redis client ===
 load_dotenv()
-r = redis.Redis(host=os.getenv('REDIS_HOST'), port=os.getenv('REDIS_PORT'), db=0)
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 64))
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5))
+redis_pool = aioredis.BlockingConnectionPool(
+    host=os.getenv('REDIS_HOST'),
+    port=os.getenv('REDIS_PORT'),
+    db=0,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=REDIS_POOL_TIMEOUT,
+)
+r = aioredis.Redis(connection_pool=redis_pool)
+
+# === Blob storage ===
+# Ciphertext lives in a blob store (see blob_store.py); Redis keeps metadata.
+# BLOB_BACKEND=fs stores blobs under BLOB_DIR, BLOB_BACKEND=redis in blob:* keys
+BLOB_BACKEND = os.getenv('BLOB_BACKEND', 'fs')
+BLOB_DIR = os.getenv('BLOB_DIR', 'blobs')
+# Uploads are written and downloads read in pieces of at most these many bytes,
+# so server memory per transfer stays constant whatever the file size
+BLOB_WRITE_BUFFER = int(os.getenv('BLOB_WRITE_BUFFER', 1 << 20))
+BLOB_READ_BUFFER = int(os.getenv('BLOB_READ_BUFFER', 1 << 20))
+# Blobs of uploads that never commit are deleted this many seconds after being written
+BLOB_STAGING_TTL = int(os.getenv('BLOB_STAGING_TTL', 3600))
+BLOB_SWEEP_INTERVAL = int(os.getenv('BLOB_SWEEP_INTERVAL', 60))
+# In-process cache of hot blobs, bounded by total bytes (0 disables it); blobs
+# larger than BLOB_CACHE_MAX_ITEM are never cached
+BLOB_CACHE_BYTES = int(os.getenv('BLOB_CACHE_BYTES', 0))
+BLOB_CACHE_MAX_ITEM = int(os.getenv('BLOB_CACHE_MAX_ITEM', max(BLOB_CACHE_BYTES // 8, 1)))
+blob_store = make_blob_store(
+    BLOB_BACKEND,
+    r,
+    BLOB_DIR,
+    staging_ttl=BLOB_STAGING_TTL,
+    write_buffer=BLOB_WRITE_BUFFER,
+    read_buffer=BLOB_READ_BUFFER,
+    sweep_interval=BLOB_SWEEP_INTERVAL,
+    log=log,
+)
+# Chunked upload sessions (and their chunks) expire this long after /upload_init
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', 86400))
+UPLOAD_MAX_CHUNKS = int(os.getenv('UPLOAD_MAX_CHUNKS', 10000))
+# Largest page /list_files returns
+LIST_PAGE_MAX = int(os.getenv('LIST_PAGE_MAX', 1000))
+# Index entries fetched per round trip when a time-sorted listing filters by prefix
+LIST_SCAN_BATCH = 100
+# Entries kept in the change log behind /list_files?since= (see changelog.py)
+CHANGELOG_MAX = int(os.getenv('CHANGELOG_MAX', 100000))
+# /download_batch: most files per request, and how many files ahead of the
+# one being sent are looked up and have their first read buffer fetched
+DOWNLOAD_BATCH_MAX = int(os.getenv('DOWNLOAD_BATCH_MAX', 1000))
+DOWNLOAD_BATCH_PREFETCH = int(os.getenv('DOWNLOAD_BATCH_PREFETCH', 4))
+
+# === Session tokens ===
+# With DATA_REQUIRE_SESSION=1, upload and download require a signed session
+# token issued by the KMS (SESSION_MODE=token, same SESSION_SECRET). Otherwise
+# anyone may upload and download, and KMS sessions in Redis mode are only
+# looked up to name the caller (see authorize)
+# JSON is encoded with orjson and clients may negotiate msgpack (see codec.py);
+# 0 keeps the standard library encoder
+FAST_ENCODING = os.getenv('FAST_ENCODING', '1') == '1'
+DATA_REQUIRE_SESSION = os.getenv('DATA_REQUIRE_SESSION', '0') == '1'
+session_tokens = None
+if DATA_REQUIRE_SESSION:
+    session_tokens = SessionTokens(
+        os.getenv('SESSION_SECRET'),
+        r,
+        int(os.getenv('SESSION_TTL', 1800)),
+        refresh=int(os.getenv('REVOCATION_REFRESH', 60)),
+        log=log,
+    )
 
 # === FastAPI App ===
 app = FastAPI(
@@ -38,6 +119,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(Negotiation, fast=FAST_ENCODING)
 
 # === Request Models ===
 class UploadRequest(BaseModel):
@@ -46,32 +128,658 @@ class UploadRequest(BaseModel):
     encrypted_aes_key: str
     encrypted_aes_initial_vector: str
 
+class UploadInitRequest(BaseModel):
+    file_name: str
+    encrypted_aes_key: str
+    encrypted_aes_initial_vector: str
+    chunk_count: int
+
+class UploadSessionRequest(BaseModel):
+    upload_id: str
+
+class DownloadBatchRequest(BaseModel):
+    file_names: List[str]
+
+class DeleteRequest(BaseModel):
+    file_name: str
+
 # === Utilities ===
 
-def file_exists(fname: str) -> bool:
-    return r.exists(f"filedata:{fname}") == 1
+async def authorize(sid: Optional[str], identify: bool = True) -> Optional[str]:
+    """Returns the caller's email, '' for an anonymous caller, or None if the token is rejected.
 
+    Without DATA_REQUIRE_SESSION nobody is rejected, but a KMS session in Redis
+    mode (session:{sid}, same database) still names the caller so uploads
+    record an owner and deletes can check it. identify=False skips that lookup
+    where only the gate matters (downloads)."""
+    if session_tokens:
+        return await session_tokens.verify(sid)
+    if not sid or not identify:
+        return ""
+    email = await r.get(f"session:{sid}")
+    return email.decode() if email else ""
+
+
+def invalid_session():
+    return JSONResponse(
+        status_code=403,
+        content={"code": 403, "message": "invalid_session"}
+    )
+
+async def file_exists(fname: str) -> bool:
+    return await r.exists(f"filedata:{fname}") == 1
+
+
+# === File records ===
+# filedata:{name} holds encrypted_aes_key, encrypted_aes_iv and the file's
+# blob manifest: "blobs" (comma separated blob ids, in order), their byte
+# "sizes", the total "size" and the content "digest" (see manifest_digest). Records written before the blob store have an
+# inline base64 "encrypted_data" field instead until migrate_blobs.py moves it.
+# "owner" is the uploader's email ('' without DATA_REQUIRE_SESSION). Deleting
+# needs a verified session matching a non-empty owner, so records without one
+# (uploaded without sessions, or before owners were recorded) cannot be deleted.
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    The first caller (the leader) runs the work in its own task; callers that
+    arrive while it is running await the same result instead of repeating the
+    backend fetch. A caller that disconnects does not cancel the shared work.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        task = self.flights.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.create_task(fn())
+            self.flights[key] = task
+            task.add_done_callback(lambda _: self.flights.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {"in_flight": len(self.flights), "leaders": self.leaders, "coalesced": self.coalesced}
+
+single_flight = SingleFlight()
+
+
+async def get_file_meta(fname: str):
+    """Everything about a file except its bytes; inline (legacy) records get blobs=None.
+
+    Concurrent lookups of one file share a single Redis round trip, so callers
+    must not modify the returned dict.
+    """
+    return await single_flight.do(("meta", fname), lambda: load_file_meta(fname))
+
+
+async def load_file_meta(fname: str):
+    # One round trip whatever the layout; encrypted_data is only set on legacy inline records
+    fields = ('encrypted_aes_key', 'encrypted_aes_iv', 'blobs', 'sizes', 'digest', 'uploaded_at', 'encrypted_data')
+    values = await r.hmget(f"filedata:{fname}", fields)
+    if values[0] is None:
+        return None
+    meta = {k: v.decode() if v is not None else None for k, v in zip(fields, values)}
+    inline = meta.pop('encrypted_data')
+    if meta['blobs'] is None:
+        data = base64.b64decode(inline)
+        meta['inline'] = data
+        meta['size'] = len(data)
+        meta['digest'] = hashlib.sha256(data).hexdigest()
+    else:
+        meta['blobs'] = meta['blobs'].split(',')
+        meta['sizes'] = [int(n) for n in meta['sizes'].split(',')]
+        meta['size'] = sum(meta['sizes'])
+        # Records written before digests were stored
+        meta['digest'] = meta['digest'] or manifest_digest(meta['blobs'])
+    meta['uploaded_at'] = int(meta['uploaded_at'] or 0)
+    return meta
+
+
+def etag_of(meta: dict) -> str:
+    return f'"{meta["digest"]}"'
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """If-None-Match / If-Range comparison (weak, so W/ prefixes are ignored)."""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def not_modified(etag: str):
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+class BlobCache:
+    """LRU of blob contents bounded by total bytes, with frequency-based admission.
+
+    Blobs are immutable and named by their content, so an entry can never be
+    stale: overwriting a file points it at different blob ids, and entries of
+    blobs no file uses are dropped with discard(). A blob is only admitted on
+    its second miss among recently missed ids, so one-off downloads of large
+    files do not flush the files that are actually hot.
+    """
+
+    def __init__(self, capacity, max_item, seen_size=4096):
+        self.capacity = capacity
+        self.max_item = max_item
+        self.entries = OrderedDict()
+        self.seen = OrderedDict()
+        self.seen_size = seen_size
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, blob_id):
+        data = self.entries.get(blob_id)
+        if data is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(blob_id)
+        self.hits += 1
+        return data
+
+    def wants(self, blob_id, size):
+        """Whether a miss on this blob should be read whole and put()."""
+        if not self.capacity or size > self.max_item:
+            return False
+        if blob_id in self.seen:
+            return True
+        self.seen[blob_id] = None
+        if len(self.seen) > self.seen_size:
+            self.seen.popitem(last=False)
+        return False
+
+    def put(self, blob_id, data):
+        if blob_id in self.entries or len(data) > self.max_item:
+            return
+        self.seen.pop(blob_id, None)
+        self.entries[blob_id] = data
+        self.bytes += len(data)
+        while self.bytes > self.capacity:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.evictions += 1
+
+    def discard(self, blob_id):
+        data = self.entries.pop(blob_id, None)
+        if data is not None:
+            self.bytes -= len(data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "capacity_bytes": self.capacity,
+            "max_item_bytes": self.max_item,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+blob_cache = BlobCache(BLOB_CACHE_BYTES, BLOB_CACHE_MAX_ITEM)
+
+
+async def read_blob(blob_id: str, size: int, start: int, end: int):
+    """Yields bytes start..end (inclusive) of one blob, through the hot-blob cache."""
+    data = blob_cache.get(blob_id) if blob_cache.capacity else None
+    if data is None and blob_cache.wants(blob_id, size):
+        data = b"".join([piece async for piece in blob_store.read(blob_id, 0, size - 1)])
+        blob_cache.put(blob_id, data)
+    if data is None:
+        async for piece in blob_store.read(blob_id, start, end):
+            yield piece
+        return
+    view = memoryview(data)
+    for off in range(start, end + 1, BLOB_READ_BUFFER):
+        yield view[off:min(off + BLOB_READ_BUFFER, end + 1)]
+
+
+async def iter_file(meta: dict, start: int, end: int):
+    """Yields bytes start..end (inclusive) of a file, at most BLOB_READ_BUFFER at a time."""
+    if meta['blobs'] is None:
+        for off in range(start, end + 1, BLOB_READ_BUFFER):
+            yield meta['inline'][off:min(off + BLOB_READ_BUFFER, end + 1)]
+        return
+    base = 0
+    for blob_id, size in zip(meta['blobs'], meta['sizes']):
+        if base > end:
+            break
+        lo, hi = max(start, base), min(end, base + size - 1)
+        if lo <= hi:
+            async for piece in read_blob(blob_id, size, lo - base, hi - base):
+                yield piece
+        base += size
+
+
+def parse_range(header: Optional[str], size: int):
+    """Returns (start, end) for a single "bytes=" range, None to send the whole file,
+    or raises ValueError if the range cannot be satisfied.
+
+    Multiple ranges and malformed headers are ignored, which RFC 9110 allows.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, sep, last = header[6:].strip().partition("-")
+    if not sep or not (first + last).isdigit():
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("range not satisfiable")
+        return max(0, size - length), size - 1
+    if last and int(last) < int(first):
+        return None
+    start = int(first)
+    if start >= size:
+        raise ValueError("range not satisfiable")
+    return start, (min(int(last), size - 1) if last else size - 1)
+
+# === File index ===
+# files_by_name lists every file name (score 0, lexicographic order) and
+# files_by_time every "<upload time ms, 15 digits>|<name>", so /list_files
+# pages through either order with range queries instead of KEYS. Both are
+# updated by the scripts that publish or remove a filedata record, which also
+# store the record's "uploaded_at" and append to the change log.
+FILES_BY_NAME = "files_by_name"
+FILES_BY_TIME = "files_by_time"
+
+
+def upload_stamp() -> str:
+    return f"{int(time.time() * 1000):015d}"
+
+# Prepended to scripts that publish a file record
+PUBLISH_LUA = changelog_lua(CHANGELOG_MAX) + """
+local function publish(name, stamp)
+  redis.call('HSET', 'filedata:' .. name, 'uploaded_at', tonumber(stamp))
+  redis.call('ZADD', 'files_by_name', 0, name)
+  redis.call('ZADD', 'files_by_time', 0, stamp .. '|' .. name)
+  log_change('upload', name)
+end
+"""
+
+# KEYS: filedata:{name}, blob_refs, blob_staging; ARGV: aes_key, iv, blob_id, size, name, stamp, owner
+# -> 1 stored | 0 name taken (the blob stays staged for the sweeper)
+COMMIT_BLOB_LUA = PUBLISH_LUA + """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+  return 0
+end
+redis.call('HSET', KEYS[1], 'encrypted_aes_key', ARGV[1], 'encrypted_aes_iv', ARGV[2],
+           'blobs', ARGV[3], 'sizes', ARGV[4], 'size', ARGV[4], 'digest', ARGV[3], 'owner', ARGV[7])
+publish(ARGV[5], ARGV[6])
+redis.call('HINCRBY', KEYS[2], ARGV[3], 1)
+redis.call('ZREM', KEYS[3], ARGV[3])
+return 1
+"""
+commit_blob_script = r.register_script(COMMIT_BLOB_LUA)
+
+
+async def commit_blob(fname: str, aes_key: str, iv: str, writer, owner: str) -> bool:
+    """Publishes a written blob as file `fname`; False if the name is taken."""
+    res = await commit_blob_script(
+        keys=[f"filedata:{fname}", BLOB_REFS, BLOB_STAGING],
+        args=[aes_key, iv, writer.blob_id, writer.size, fname, upload_stamp(), owner],
+    )
+    return res == 1
+
+# Deleting a file releases its blobs: one whose count drops to zero is staged
+# with a deadline, like an uncommitted upload, and the sweeper UNLINKs it (or
+# removes the file) in the background. The grace period lets downloads that
+# already hold the manifest finish.
+# Records uploaded without a session have no owner; for those the owner of the
+# file's KMS key record (file:{name}, same Redis) decides, which is why clients
+# delete here before deleting the keys on the KMS.
+# KEYS: filedata:{name}, blob_refs, blob_staging, files_by_name, files_by_time, file:{name} (KMS)
+# ARGV: name, owner, deadline
+# -> {1, released blob ids...} deleted | {-1} no such file | {-2} not the owner
+DELETE_FILE_LUA = changelog_lua(CHANGELOG_MAX) + """
+local meta = redis.call('HMGET', KEYS[1], 'encrypted_aes_key', 'blobs', 'uploaded_at', 'owner')
+if not meta[1] then
+  return {-1}
+end
+local owner = meta[4]
+if not owner or owner == '' then
+  owner = redis.call('HGET', KEYS[6], 'owner')
+end
+if owner ~= ARGV[2] then
+  return {-2}
+end
+local out = {1}
+for blob_id in string.gmatch(meta[2] or '', '[^,]+') do
+  if redis.call('HINCRBY', KEYS[2], blob_id, -1) <= 0 then
+    redis.call('HDEL', KEYS[2], blob_id)
+    local current = redis.call('ZSCORE', KEYS[3], blob_id)
+    if not current or tonumber(current) < tonumber(ARGV[3]) then
+      redis.call('ZADD', KEYS[3], ARGV[3], blob_id)
+    end
+    out[#out + 1] = blob_id
+  end
+end
+redis.call('UNLINK', KEYS[1])
+redis.call('ZREM', KEYS[4], ARGV[1])
+redis.call('ZREM', KEYS[5], string.format('%015d', tonumber(meta[3] or 0)) .. '|' .. ARGV[1])
+log_change('delete', ARGV[1])
+return out
+"""
+delete_file_script = r.register_script(DELETE_FILE_LUA)
+
+async def list_by_name(limit: int, cursor: Optional[str], prefix: str):
+    start = f"({cursor}" if cursor else f"[{prefix}"
+    # Built as bytes: 0xff sorts after every UTF-8 byte, whereas the str "\xff"
+    # would be sent as c3 bf and cut off names continuing with e.g. CJK characters
+    end = b"[" + prefix.encode() + b"\xff" if prefix else "+"
+    names = await r.zrangebylex(FILES_BY_NAME, start, end, start=0, num=limit)
+    files = [n.decode() for n in names]
+    return files, files[-1] if len(files) == limit else None
 
-def save_file(fname: str, data: str, aes_key: str, iv: str):
-    key = f"filedata:{fname}"
-    r.hset(key, mapping={
-        'encrypted_data': data,
-        'encrypted_aes_key': aes_key,
-        'encrypted_aes_iv': iv
-    })
 
+async def list_by_time(limit: int, cursor: Optional[str], prefix: str):
+    """Newest first. Entries not matching `prefix` are skipped; with a prefix,
+    entries are fetched LIST_SCAN_BATCH (or `limit`, if larger) at a time and a
+    call stops after about LIST_PAGE_MAX of them, so it makes a bounded number
+    of round trips and a page can come back short with a cursor to continue from."""
+    end = f"({cursor}" if cursor else "+"
+    batch_size = max(limit, LIST_SCAN_BATCH) if prefix else limit
+    files, last = [], None
+    for _ in range(max(1, LIST_PAGE_MAX // batch_size)):
+        batch = await r.zrevrangebylex(FILES_BY_TIME, end, "-", start=0, num=batch_size)
+        for entry in batch:
+            last = entry.decode()
+            name = last.split("|", 1)[1]
+            if name.startswith(prefix):
+                files.append(name)
+                if len(files) == limit:
+                    return files, last
+        if len(batch) < batch_size:
+            return files, None
+        end = f"({last}"
+    return files, last
 
-def get_file(fname: str):
-    key = f"filedata:{fname}"
-    if not r.exists(key):
+# === Chunked uploads ===
+# upload:{id} holds the pending file's metadata (file_name, encrypted_aes_key,
+# encrypted_aes_iv, chunk_count, owner) and upload_chunks:{id} maps each
+# received chunk index to "<blob_id>:<size>". Chunks are independent blobs, so
+# they can arrive in parallel, in any order, and be re-sent individually; the
+# commit script turns them into the file's blob manifest in one step. Chunk
+# blobs stay staged until the session's expiry, so the sweeper collects the
+# chunks of uploads that are aborted, replaced or never committed.
+
+async def create_upload(fname: str, aes_key: str, iv: str, chunk_count: int, owner: str) -> str:
+    upload_id = uuid.uuid4().hex
+    key = f"upload:{upload_id}"
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping={
+            'file_name': fname,
+            'encrypted_aes_key': aes_key,
+            'encrypted_aes_iv': iv,
+            'chunk_count': chunk_count,
+            'owner': owner,
+        })
+        pipe.expire(key, UPLOAD_SESSION_TTL)
+        await pipe.execute()
+    return upload_id
+
+# KEYS: upload:{id}, upload_chunks:{id}; ARGV: index, blob_id, size, owner
+# -> 1 stored | -1 no such upload | -2 not the owner | -3 index out of range
+UPLOAD_CHUNK_LUA = """
+local meta = redis.call('HMGET', KEYS[1], 'chunk_count', 'owner')
+local reject = 0
+if not meta[1] then
+  reject = -1
+elseif meta[2] ~= ARGV[4] then
+  reject = -2
+elseif tonumber(ARGV[1]) >= tonumber(meta[1]) then
+  reject = -3
+end
+if reject ~= 0 then
+  return reject
+end
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2] .. ':' .. ARGV[3])
+redis.call('PEXPIRE', KEYS[2], redis.call('PTTL', KEYS[1]))
+return 1
+"""
+upload_chunk_script = r.register_script(UPLOAD_CHUNK_LUA)
+
+# KEYS: upload:{id}, upload_chunks:{id}, blob_refs, blob_staging; ARGV: owner, stamp, blobs, digest
+# ARGV[3] is the manifest the caller computed the digest for; a chunk re-sent
+# since then changes it.
+# -> {1, size} committed | {0} name taken (upload discarded) | {-1} no such upload
+#    | {-2} not the owner | {-3} chunks missing | {-4} manifest changed
+COMMIT_UPLOAD_LUA = PUBLISH_LUA + """
+local meta = redis.call('HMGET', KEYS[1], 'file_name', 'encrypted_aes_key', 'encrypted_aes_iv',
+                        'chunk_count', 'owner')
+if not meta[1] then
+  return {-1}
+end
+if meta[5] ~= ARGV[1] then
+  return {-2}
+end
+local count = tonumber(meta[4])
+if redis.call('HLEN', KEYS[2]) < count then
+  return {-3}
+end
+local blobs, sizes, total = {}, {}, 0
+for i = 0, count - 1 do
+  local entry = redis.call('HGET', KEYS[2], tostring(i))
+  local blob_id, size = string.match(entry, '^([^:]+):(%d+)$')
+  blobs[#blobs + 1] = blob_id
+  sizes[#sizes + 1] = size
+  total = total + tonumber(size)
+end
+if table.concat(blobs, ',') ~= ARGV[3] then
+  return {-4}
+end
+local file_key = 'filedata:' .. meta[1]
+redis.call('UNLINK', KEYS[1], KEYS[2])
+if redis.call('EXISTS', file_key) == 1 then
+  return {0}
+end
+for _, blob_id in ipairs(blobs) do
+  redis.call('HINCRBY', KEYS[3], blob_id, 1)
+  redis.call('ZREM', KEYS[4], blob_id)
+end
+redis.call('HSET', file_key, 'encrypted_aes_key', meta[2], 'encrypted_aes_iv', meta[3],
+           'blobs', ARGV[3], 'sizes', table.concat(sizes, ','), 'size', total, 'digest', ARGV[4],
+           'owner', meta[5])
+publish(meta[1], ARGV[2])
+return {1, total}
+"""
+commit_upload_script = r.register_script(COMMIT_UPLOAD_LUA)
+
+# KEYS: upload:{id}, upload_chunks:{id}; ARGV: owner -> 1 aborted | -1 no such upload | -2 not the owner
+ABORT_UPLOAD_LUA = """
+local owner = redis.call('HGET', KEYS[1], 'owner')
+if not owner then
+  return -1
+end
+if owner ~= ARGV[1] then
+  return -2
+end
+redis.call('UNLINK', KEYS[1], KEYS[2])
+return 1
+"""
+abort_upload_script = r.register_script(ABORT_UPLOAD_LUA)
+
+
+def upload_keys(upload_id: str):
+    return [f"upload:{upload_id}", f"upload_chunks:{upload_id}"]
+
+
+async def upload_status(upload_id: str):
+    """Returns (metadata, received chunk indexes) or None if the upload does not exist."""
+    async with r.pipeline(transaction=False) as pipe:
+        pipe.hgetall(f"upload:{upload_id}")
+        pipe.hkeys(f"upload_chunks:{upload_id}")
+        meta, received = await pipe.execute()
+    if not meta:
         return None
-    rec = r.hgetall(key)
-    return {k.decode(): v.decode() for k, v in rec.items()}
+    return {k.decode(): v.decode() for k, v in meta.items()}, sorted(int(i) for i in received)
+
+
+async def check_upload_chunk(upload_id: str, index: int, owner: str):
+    """The checks UPLOAD_CHUNK_LUA makes, run before the body is read -> (result, ttl)."""
+    async with r.pipeline(transaction=False) as pipe:
+        pipe.ttl(f"upload:{upload_id}")
+        pipe.hmget(f"upload:{upload_id}", 'chunk_count', 'owner')
+        ttl, (chunk_count, upload_owner) = await pipe.execute()
+    if ttl <= 0 or chunk_count is None:
+        return -1, 0
+    if upload_owner.decode() != owner:
+        return -2, 0
+    if index >= int(chunk_count):
+        return -3, 0
+    return 1, ttl
+
+
+def upload_error(res: int):
+    if res == -1:
+        return JSONResponse(
+            status_code=404,
+            content={"code": 404, "message": "upload_not_found"}
+        )
+    if res == -2:
+        return JSONResponse(
+            status_code=403,
+            content={"code": 403, "message": "permission_denied"}
+        )
+    if res == -3:
+        return JSONResponse(
+            status_code=400,
+            content={"code": 400, "message": "invalid_chunk"}
+        )
+    return JSONResponse(
+        status_code=409,
+        content={"code": 409, "message": "file_exists"}
+    )
+
+# === Batch downloads ===
+# /download_batch streams a POSIX (pax) tar with one member per requested file,
+# in request order (repeated names once). Members are numbered ("000000",
+# "000001", ...) rather than named after the file, so extracting the archive
+# cannot write outside the target directory whatever the names contain; the
+# name itself is in the CRYSPY.file_name pax header. The member holds the
+# ciphertext; pax headers carry the wrapped key and IV (CRYSPY.encrypted_aes_key,
+# CRYSPY.encrypted_aes_iv) and the digest. A file that does not exist is an
+# empty member with CRYSPY.error=file_not_found.
+
+def tar_header(name: str, size: int, mtime: float, pax: dict) -> bytes:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = mtime
+    info.mode = 0o644
+    info.pax_headers = pax
+    return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+
+async def prefetch_file(name: str):
+    """Looks a file up and reads its first piece; returns (name, meta, first piece, remaining pieces)."""
+    meta = await get_file_meta(name)
+    if not meta:
+        return name, None, None, None
+    pieces = iter_file(meta, 0, meta['size'] - 1)
+    try:
+        first = await pieces.__anext__()
+    except StopAsyncIteration:
+        first = None
+    return name, meta, first, pieces
+
+
+async def iter_archive(names: list):
+    """Yields the tar for `names`, keeping at most DOWNLOAD_BATCH_PREFETCH files
+    (one read buffer each) in flight ahead of the file being sent."""
+    pending = iter(names)
+    window = deque()
+
+    def refill():
+        for name in pending:
+            window.append(asyncio.create_task(prefetch_file(name)))
+            if len(window) >= DOWNLOAD_BATCH_PREFETCH:
+                break
+
+    pieces = None
+    index = 0
+    refill()
+    try:
+        while window:
+            name, meta, first, pieces = await window.popleft()
+            refill()
+            member = f"{index:06d}"
+            index += 1
+            if meta is None:
+                yield tar_header(member, 0, 0, {"CRYSPY.file_name": name, "CRYSPY.error": "file_not_found"})
+                continue
+            yield tar_header(member, meta['size'], meta['uploaded_at'] / 1000, {
+                "CRYSPY.file_name": name,
+                "CRYSPY.encrypted_aes_key": meta['encrypted_aes_key'],
+                "CRYSPY.encrypted_aes_iv": meta['encrypted_aes_iv'],
+                "CRYSPY.digest": meta['digest'],
+            })
+            if first is not None:
+                yield first
+                async for piece in pieces:
+                    yield piece
+            if meta['size'] % tarfile.BLOCKSIZE:
+                yield bytes(tarfile.BLOCKSIZE - meta['size'] % tarfile.BLOCKSIZE)
+        yield bytes(2 * tarfile.BLOCKSIZE)
+    finally:
+        # The client went away: close the file being sent and drop the ones ahead
+        if pieces is not None:
+            await pieces.aclose()
+        for task in window:
+            task.cancel()
+        for task in window:
+            try:
+                _, _, _, ahead = await task
+            except (asyncio.CancelledError, Exception):
+                continue
+            if ahead is not None:
+                await ahead.aclose()
+
+# === Lifecycle ===
+
+async def preload_scripts():
+    """Loads every Lua script up front so that even the first call of each is a single EVALSHA."""
+    scripts = [commit_blob_script, delete_file_script, upload_chunk_script, commit_upload_script, abort_upload_script,
+               *blob_store.scripts()]
+    async with r.pipeline(transaction=False) as pipe:
+        for script in scripts:
+            pipe.script_load(script.script)
+        await pipe.execute()
+
+@app.on_event("startup")
+async def start_workers():
+    await preload_scripts()
+    if session_tokens:
+        session_tokens.start()
+    blob_store.start()
+
+@app.on_event("shutdown")
+async def stop_workers():
+    if session_tokens:
+        await session_tokens.stop()
+    await blob_store.stop()
+    await redis_pool.disconnect()
 
 # === Endpoints ===
 
 @app.post("/upload")
-async def upload(payload: UploadRequest):
+async def upload(payload: UploadRequest, sid: Optional[str] = Header(None)):
+    owner = await authorize(sid)
+    if owner is None:
+        log(f"[UPLOAD] Invalid session for '{payload.file_name}'")
+        return invalid_session()
     # Validate all fields
     if not payload.file_name or not payload.encrypted_data \
        or not payload.encrypted_aes_key or not payload.encrypted_aes_initial_vector:
@@ -79,56 +787,464 @@ async def upload(payload: UploadRequest):
             status_code=400,
             content={"code": 400, "message": "missing_fields"}
         )
-    if file_exists(payload.file_name):
+    # No separate existence check: the commit script refuses taken names atomically
+    try:
+        data = base64.b64decode(payload.encrypted_data, validate=True)
+    except binascii.Error:
         return JSONResponse(
-            status_code=409,
-            content={"code": 409, "message": "file_exists"}
+            status_code=400,
+            content={"code": 400, "message": "invalid_data"}
         )
-    save_file(
+    writer = await blob_store.write_bytes(data)
+    if not await commit_blob(
         payload.file_name,
-        payload.encrypted_data,
         payload.encrypted_aes_key,
-        payload.encrypted_aes_initial_vector
-    )
-    log(f"[UPLOAD] Stored file '{payload.file_name}' in Redis with IV")
+        payload.encrypted_aes_initial_vector,
+        writer,
+        owner
+    ):
+        return JSONResponse(
+            status_code=409,
+            content={"code": 409, "message": "file_exists"}
+        )
+    log(f"[UPLOAD] Stored file '{payload.file_name}' as blob {writer.blob_id}")
     return JSONResponse(
         status_code=200,
         content={"code": 200, "message": "upload_success"}
     )
 
 @app.get("/download")
-async def download(file_name: str):
-    record = get_file(file_name)
-    if not record:
+async def download(
+    file_name: str,
+    if_none_match: Optional[str] = Header(None),
+    sid: Optional[str] = Header(None),
+):
+    if await authorize(sid, identify=False) is None:
+        log(f"[DOWNLOAD] Invalid session for '{file_name}'")
+        return invalid_session()
+    meta = await get_file_meta(file_name)
+    if not meta:
         return JSONResponse(
             status_code=404,
             content={"code": 404, "message": "file_not_found"}
         )
-    log(f"[DOWNLOAD] Retrieved file '{file_name}' from Redis")
+    etag = etag_of(meta)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    codec = current_codec.get()
+
+    async def render():
+        # The stored pieces are encoded straight into body parts: no joined
+        # copy of the file, no str round trip
+        pieces = [piece async for piece in iter_file(meta, 0, meta['size'] - 1)]
+        return codec.encode_with_blob({
+            "code": 200,
+            "encrypted_aes_key": meta["encrypted_aes_key"],
+            "encrypted_aes_initial_vector": meta["encrypted_aes_iv"]
+        }, "encrypted_data", pieces)
+
+    # Concurrent downloads of the same content share one read and one encoded body
+    parts = await single_flight.do(("download", file_name, meta["digest"], codec.name), render)
+    log(f"[DOWNLOAD] Retrieved file '{file_name}'")
+
+    async def send_parts():
+        for part in parts:
+            yield part
+
+    return StreamingResponse(
+        send_parts(),
+        status_code=200,
+        media_type=codec.media_type,
+        headers={"ETag": etag, "Vary": "Accept", "Content-Length": str(sum(len(part) for part in parts))}
+    )
+
+def file_headers(meta: dict):
+    return {
+        "Accept-Ranges": "bytes",
+        "ETag": etag_of(meta),
+        "X-Encrypted-AES-Key": meta['encrypted_aes_key'],
+        "X-Encrypted-AES-IV": meta['encrypted_aes_iv'],
+        "X-Uploaded-At": str(meta['uploaded_at']),
+    }
+
+@app.get("/file_info")
+async def file_info(file_name: str, sid: Optional[str] = Header(None)):
+    """Size, digest and upload time (ms) from the record alone, without reading the contents."""
+    if await authorize(sid, identify=False) is None:
+        return invalid_session()
+    meta = await get_file_meta(file_name)
+    if not meta:
+        return JSONResponse(
+            status_code=404,
+            content={"code": 404, "message": "file_not_found"}
+        )
+    return JSONResponse(
+        status_code=200,
+        content={
+            "code": 200,
+            "file_name": file_name,
+            "size": meta['size'],
+            "digest": meta['digest'],
+            "uploaded_at": meta['uploaded_at'],
+        },
+        headers={"ETag": etag_of(meta)}
+    )
+
+@app.head("/download_stream")
+async def download_stream_head(file_name: str, sid: Optional[str] = Header(None)):
+    if await authorize(sid, identify=False) is None:
+        return Response(status_code=403)
+    meta = await get_file_meta(file_name)
+    if not meta:
+        return Response(status_code=404)
+    return Response(status_code=200, headers={**file_headers(meta), "Content-Length": str(meta['size'])})
+
+@app.get("/download_stream")
+async def download_stream(
+    file_name: str,
+    range: Optional[str] = Header(None),
+    if_range: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    sid: Optional[str] = Header(None),
+):
+    """Raw ciphertext as the body, wrapped key and IV in headers; supports a single byte Range."""
+    if await authorize(sid, identify=False) is None:
+        log(f"[DOWNLOAD_STREAM] Invalid session for '{file_name}'")
+        return invalid_session()
+    meta = await get_file_meta(file_name)
+    if not meta:
+        return JSONResponse(
+            status_code=404,
+            content={"code": 404, "message": "file_not_found"}
+        )
+    size = meta['size']
+    headers = file_headers(meta)
+    if etag_matches(if_none_match, headers["ETag"]):
+        return not_modified(headers["ETag"])
+    if if_range and not etag_matches(if_range, headers["ETag"]):
+        # The client's partial copy is of different content; send it all
+        range = None
+    try:
+        requested = parse_range(range, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if size == 0:
+        return Response(status_code=200, headers=headers)
+    status_code = 200
+    start, end = 0, size - 1
+    if requested:
+        status_code = 206
+        start, end = requested
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    log(f"[DOWNLOAD_STREAM] Streaming '{file_name}' bytes {start}-{end}/{size}")
+    return StreamingResponse(
+        iter_file(meta, start, end),
+        status_code=status_code,
+        media_type="application/octet-stream",
+        headers=headers
+    )
+
+@app.post("/download_batch")
+async def download_batch(payload: DownloadBatchRequest, sid: Optional[str] = Header(None)):
+    """Several files as one streamed tar; see "Batch downloads" above for the layout."""
+    if await authorize(sid, identify=False) is None:
+        log("[DOWNLOAD_BATCH] Invalid session")
+        return invalid_session()
+    names = list(dict.fromkeys(payload.file_names))
+    if not names:
+        return JSONResponse(
+            status_code=400,
+            content={"code": 400, "message": "missing_fields"}
+        )
+    if len(names) > DOWNLOAD_BATCH_MAX:
+        return JSONResponse(
+            status_code=400,
+            content={"code": 400, "message": "batch_too_large", "max_batch": DOWNLOAD_BATCH_MAX}
+        )
+    log(f"[DOWNLOAD_BATCH] Streaming {len(names)} files")
+    return StreamingResponse(
+        iter_archive(names),
+        status_code=200,
+        media_type="application/x-tar",
+        headers={"Content-Disposition": 'attachment; filename="files.tar"'}
+    )
+
+@app.post("/upload_stream")
+async def upload_stream(
+    request: Request,
+    file_name: str,
+    x_encrypted_aes_key: Optional[str] = Header(None),
+    x_encrypted_aes_iv: Optional[str] = Header(None),
+    sid: Optional[str] = Header(None),
+):
+    """Raw ciphertext in the body, wrapped key and IV in headers; bytes go to storage as they arrive."""
+    owner = await authorize(sid)
+    if owner is None:
+        log(f"[UPLOAD_STREAM] Invalid session for '{file_name}'")
+        return invalid_session()
+    if not file_name or not x_encrypted_aes_key or not x_encrypted_aes_iv:
+        return JSONResponse(
+            status_code=400,
+            content={"code": 400, "message": "missing_fields"}
+        )
+    # Early rejection so a large body is not stored in vain; the commit
+    # script below is what guarantees the name is not taken
+    if await file_exists(file_name):
+        return JSONResponse(
+            status_code=409,
+            content={"code": 409, "message": "file_exists"}
+        )
+    writer = await blob_store.write_stream(request.stream())
+    if not await commit_blob(file_name, x_encrypted_aes_key, x_encrypted_aes_iv, writer, owner):
+        return JSONResponse(
+            status_code=409,
+            content={"code": 409, "message": "file_exists"}
+        )
+    log(f"[UPLOAD_STREAM] Stored file '{file_name}' ({writer.size} bytes) as blob {writer.blob_id}")
+    return JSONResponse(
+        status_code=200,
+        content={"code": 200, "message": "upload_success", "size": writer.size, "digest": writer.blob_id}
+    )
+
+@app.post("/upload_init")
+async def upload_init(payload: UploadInitRequest, sid: Optional[str] = Header(None)):
+    owner = await authorize(sid)
+    if owner is None:
+        log(f"[UPLOAD_INIT] Invalid session for '{payload.file_name}'")
+        return invalid_session()
+    if not payload.file_name or not payload.encrypted_aes_key \
+       or not payload.encrypted_aes_initial_vector:
+        return JSONResponse(
+            status_code=400,
+            content={"code": 400, "message": "missing_fields"}
+        )
+    if not 1 <= payload.chunk_count <= UPLOAD_MAX_CHUNKS:
+        return JSONResponse(
+            status_code=400,
+            content={"code": 400, "message": "invalid_chunk_count", "max": UPLOAD_MAX_CHUNKS}
+        )
+    if await file_exists(payload.file_name):
+        return JSONResponse(
+            status_code=409,
+            content={"code": 409, "message": "file_exists"}
+        )
+    upload_id = await create_upload(
+        payload.file_name,
+        payload.encrypted_aes_key,
+        payload.encrypted_aes_initial_vector,
+        payload.chunk_count,
+        owner
+    )
+    log(f"[UPLOAD_INIT] Upload {upload_id} of '{payload.file_name}' in {payload.chunk_count} chunks")
+    return JSONResponse(
+        status_code=200,
+        content={"code": 200, "message": "upload_created", "upload_id": upload_id,
+                 "expires_in": UPLOAD_SESSION_TTL}
+    )
+
+@app.put("/upload_chunk")
+async def upload_chunk(request: Request, upload_id: str, index: int, sid: Optional[str] = Header(None)):
+    """Raw chunk bytes in the body. Re-sending an index replaces the earlier copy."""
+    owner = await authorize(sid)
+    if owner is None:
+        log(f"[UPLOAD_CHUNK] Invalid session for upload {upload_id}")
+        return invalid_session()
+    if index < 0:
+        return upload_error(-3)
+    # Refuse before storing the body; the script below re-checks atomically
+    res, ttl = await check_upload_chunk(upload_id, index, owner)
+    if res != 1:
+        return upload_error(res)
+    # The chunk stays staged as long as its upload session can still commit it
+    writer = await blob_store.write_stream(request.stream(), ttl)
+    res = await upload_chunk_script(
+        keys=upload_keys(upload_id),
+        args=[index, writer.blob_id, writer.size, owner],
+    )
+    if res != 1:
+        return upload_error(res)
+    return JSONResponse(
+        status_code=200,
+        content={"code": 200, "message": "chunk_stored", "index": index, "size": writer.size}
+    )
+
+@app.get("/upload_status")
+async def get_upload_status(upload_id: str, sid: Optional[str] = Header(None)):
+    owner = await authorize(sid)
+    if owner is None:
+        return invalid_session()
+    status = await upload_status(upload_id)
+    if status is None:
+        return upload_error(-1)
+    meta, received = status
+    if meta['owner'] != owner:
+        return upload_error(-2)
+    have = set(received)
+    missing = [i for i in range(int(meta['chunk_count'])) if i not in have]
     return JSONResponse(
         status_code=200,
         content={
             "code": 200,
-            "encrypted_data": record["encrypted_data"],
-            "encrypted_aes_key": record["encrypted_aes_key"],
-            "encrypted_aes_initial_vector": record["encrypted_aes_iv"]
+            "file_name": meta['file_name'],
+            "chunk_count": int(meta['chunk_count']),
+            "received": len(received),
+            "missing": missing,
         }
     )
 
+@app.post("/upload_commit")
+async def upload_commit(payload: UploadSessionRequest, sid: Optional[str] = Header(None)):
+    owner = await authorize(sid)
+    if owner is None:
+        return invalid_session()
+    # The digest is computed here from the chunk manifest (Lua has no SHA-256);
+    # retry if a chunk is re-sent in between
+    for _ in range(3):
+        chunks = await r.hgetall(f"upload_chunks:{payload.upload_id}")
+        blobs = [entry.decode().split(':')[0] for _, entry in sorted((int(i), e) for i, e in chunks.items())]
+        res = await commit_upload_script(
+            keys=[*upload_keys(payload.upload_id), BLOB_REFS, BLOB_STAGING],
+            args=[owner, upload_stamp(), ",".join(blobs), manifest_digest(blobs) if blobs else ""],
+        )
+        if res[0] != -4:
+            break
+    if res[0] == -4:
+        return JSONResponse(
+            status_code=409,
+            content={"code": 409, "message": "upload_changed"}
+        )
+    if res[0] == -3:
+        return JSONResponse(
+            status_code=400,
+            content={"code": 400, "message": "chunks_missing"}
+        )
+    if res[0] != 1:
+        return upload_error(res[0])
+    log(f"[UPLOAD_COMMIT] Committed upload {payload.upload_id} ({res[1]} bytes)")
+    return JSONResponse(
+        status_code=200,
+        content={"code": 200, "message": "upload_success", "size": res[1], "digest": manifest_digest(blobs)}
+    )
+
+@app.post("/upload_abort")
+async def upload_abort(payload: UploadSessionRequest, sid: Optional[str] = Header(None)):
+    owner = await authorize(sid)
+    if owner is None:
+        return invalid_session()
+    res = await abort_upload_script(keys=upload_keys(payload.upload_id), args=[owner])
+    if res != 1:
+        return upload_error(res)
+    log(f"[UPLOAD_ABORT] Aborted upload {payload.upload_id}")
+    return JSONResponse(
+        status_code=200,
+        content={"code": 200, "message": "upload_aborted"}
+    )
+
+@app.post("/delete_file")
+async def delete_file(payload: DeleteRequest, sid: Optional[str] = Header(None)):
+    """Removes a file record and its listing entries; its blobs are reclaimed by the sweeper."""
+    owner = await authorize(sid)
+    if not owner:
+        log(f"[DELETE_FILE] Invalid session for '{payload.file_name}'")
+        return invalid_session()
+    res = await delete_file_script(
+        keys=[f"filedata:{payload.file_name}", BLOB_REFS, BLOB_STAGING, FILES_BY_NAME, FILES_BY_TIME,
+              f"file:{payload.file_name}"],
+        args=[payload.file_name, owner, blob_store.deadline()],
+    )
+    if res[0] == -1:
+        return JSONResponse(
+            status_code=404,
+            content={"code": 404, "message": "file_not_found"}
+        )
+    if res[0] == -2:
+        return JSONResponse(
+            status_code=403,
+            content={"code": 403, "message": "permission_denied"}
+        )
+    released = [blob_id.decode() for blob_id in res[1:]]
+    for blob_id in released:
+        blob_cache.discard(blob_id)
+    log(f"[DELETE_FILE] Deleted file '{payload.file_name}', {len(released)} blobs released")
+    return JSONResponse(
+        status_code=200,
+        content={"code": 200, "message": "delete_success"}
+    )
+
 @app.get("/list_files")
-async def list_files():
-    keys = r.keys("filedata:*")
-    files = [k.decode().split("filedata:")[1] for k in keys]
+async def list_files(
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    prefix: str = "",
+    sort: str = "name",
+    since: Optional[int] = None,
+):
+    """One page of file names, by name (ascending) or by upload time (newest first).
+
+    Pass the returned `next_cursor` to get the following page; it is null on
+    the last page. `version` is the change log version the listing reflects;
+    pass it back as `since` to get only the changes after it.
+    """
+    if sort not in ("name", "time") or limit < 1 or (since is not None and since < 0):
+        return JSONResponse(
+            status_code=400,
+            content={"code": 400, "message": "invalid_request"}
+        )
+    limit = min(limit, LIST_PAGE_MAX)
+    if since is not None:
+        version, changes, reset = await changes_since(r, since, limit)
+        log(f"[LIST_FILES] Returning {len(changes)} changes since version {since}")
+        return JSONResponse(
+            status_code=200,
+            content={
+                "code": 200,
+                "version": version,
+                "changes": changes,
+                # More changes are waiting; ask again with the new version
+                "more": len(changes) == limit,
+                # The log no longer reaches back to `since`; fetch the full listing
+                "reset": reset,
+                "message": "list_changes_success",
+            }
+        )
+    # Read the version first: changes racing with the listing are then replayed, not lost
+    version = await current_version(r)
+    if sort == "name":
+        files, next_cursor = await list_by_name(limit, cursor, prefix)
+    else:
+        files, next_cursor = await list_by_time(limit, cursor, prefix)
     log(f"[LIST_FILES] Returning {len(files)} files")
     return JSONResponse(
         status_code=200,
-        content={"code": 200, "files": files, "message": "list_files_success"}
+        content={"code": 200, "files": files, "next_cursor": next_cursor, "version": version,
+                 "message": "list_files_success"}
     )
 
+@app.get("/metrics")
+async def metrics():
+    return JSONResponse(content={
+        "code": 200,
+        "blob_cache": blob_cache.stats(),
+        "blob_store": await blob_store.stats(),
+        "single_flight": single_flight.stats(),
+        "session_tokens": session_tokens.stats() if session_tokens else None,
+    })
+
+# === Startup ===
+
+async def flush_db():
+    await r.flushdb()
+    # Blobs are unreachable without their Redis metadata
+    await blob_store.clear()
+    # Drop connections bound to this temporary loop before uvicorn starts its own
+    await redis_pool.disconnect()
+
 import uvicorn
 
 if __name__ == "__main__":
     log("Flushing Redis database for a clean start...")
-    r.flushdb()
+    asyncio.run(flush_db())
     log("Starting Data Server with FastAPI on port 4000")
     uvicorn.run(app, host="0.0.0.0", port=4000)
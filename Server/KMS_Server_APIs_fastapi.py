@@ -2,18 +2,27 @@
 from fastapi import FastAPI, Request, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import suppress
+import asyncio
+import threading
+import time
 import random
+import secrets
 import logging
 import base64
 import smtplib
-from fastapi.responses import JSONResponse
 from email.mime.text import MIMEText
-from Crypto.PublicKey import RSA
 from dotenv import load_dotenv
 import os
-import redis
+from redis import asyncio as aioredis
 import bcrypt
+from session_tokens import SessionTokens
+from changelog import changelog_lua
+from codec import JSONResponse, Negotiation
+from key_algorithms import ALGORITHMS, DEFAULT_ALGORITHM, get_algorithm
 
 # === Setup logging ===
 logging.basicConfig(
@@ -28,7 +37,16 @@ def log(msg):
 
 # === Redis client ===
 load_dotenv()
-r = redis.Redis(host=os.getenv('REDIS_HOST'), port=os.getenv('REDIS_PORT'), db=0)
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 64))
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5))
+redis_pool = aioredis.BlockingConnectionPool(
+    host=os.getenv('REDIS_HOST'),
+    port=os.getenv('REDIS_PORT'),
+    db=0,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=REDIS_POOL_TIMEOUT,
+)
+r = aioredis.Redis(connection_pool=redis_pool)
 
 # === FastAPI app ===
 app = FastAPI()
@@ -40,12 +58,55 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# JSON is encoded with orjson and clients may negotiate msgpack (see codec.py);
+# 0 keeps the standard library encoder
+FAST_ENCODING = os.getenv('FAST_ENCODING', '1') == '1'
+app.add_middleware(Negotiation, fast=FAST_ENCODING)
 
 # === SMTP Settings ===
 SMTP_SERVER = os.getenv('SMTP_SERVER')
 SMTP_PORT = os.getenv('SMTP_PORT')
 SENDER_EMAIL = os.getenv('SENDER_EMAIL')
 SENDER_PASS = os.getenv('SENDER_PASS')
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', '1') == '1'
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', 2))
+MAIL_MAX_ATTEMPTS = int(os.getenv('MAIL_MAX_ATTEMPTS', 5))
+MAIL_RETRY_BASE = float(os.getenv('MAIL_RETRY_BASE', 1.0))
+
+# === Key algorithm settings ===
+# Algorithm for files whose /get_public_key request does not name one; see key_algorithms.py
+KEY_ALGORITHM = os.getenv('KEY_ALGORITHM', DEFAULT_ALGORITHM)
+if KEY_ALGORITHM not in ALGORITHMS:
+    raise RuntimeError(f"Unknown KEY_ALGORITHM {KEY_ALGORITHM!r} (expected one of {', '.join(ALGORITHMS)})")
+
+# How long a /get_public_key reservation on a file name lasts while its key is generated
+RESERVATION_LEASE_MS = int(os.getenv('RESERVATION_LEASE_MS', 30000))
+
+# === RSA key pool settings ===
+KEY_POOL_LOW = int(os.getenv('KEY_POOL_LOW', 4))
+KEY_POOL_HIGH = int(os.getenv('KEY_POOL_HIGH', 16))
+KEY_POOL_WORKERS = int(os.getenv('KEY_POOL_WORKERS', 2))
+
+# === Session settings ===
+SESSION_TTL = int(os.getenv('SESSION_TTL', 1800))
+SESSION_SLIDING = os.getenv('SESSION_SLIDING', '0') == '1'
+# "redis": numeric sid mapped to session:{sid}; "token": signed token verified in-process
+SESSION_MODE = os.getenv('SESSION_MODE', 'redis')
+SESSION_SECRET = os.getenv('SESSION_SECRET')
+REVOCATION_REFRESH = int(os.getenv('REVOCATION_REFRESH', 60))
+
+# === Batch settings ===
+BATCH_MAX = int(os.getenv('BATCH_MAX', 256))
+GRANT_BATCH_MAX = int(os.getenv('GRANT_BATCH_MAX', 10000))
+LIST_PAGE_MAX = int(os.getenv('LIST_PAGE_MAX', 1000))
+
+# === Unwrap settings ===
+UNWRAP_CACHE_SIZE = int(os.getenv('UNWRAP_CACHE_SIZE', 1024))
+
+# === Password hashing settings ===
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+PASSWORD_WORKERS = int(os.getenv('PASSWORD_WORKERS', 4))
+PASSWORD_QUEUE_LIMIT = int(os.getenv('PASSWORD_QUEUE_LIMIT', 64))
 
 # === Models ===
 class RegisterRequest(BaseModel):
@@ -63,10 +124,33 @@ class LoginRequest(BaseModel):
 class FileNameRequest(BaseModel):
     file_name: str
 
+class PublicKeyRequest(BaseModel):
+    file_name: str
+    algorithm: Optional[str] = None
+
+class FileNamesRequest(BaseModel):
+    file_names: List[str]
+
 class GrantAccessRequest(BaseModel):
     file_name: str
     friend_email: str
 
+class GrantAccessBatchRequest(BaseModel):
+    file_names: List[str]
+    friend_emails: List[str]
+
+class UnwrapRequest(BaseModel):
+    file_name: str
+    encrypted_aes_key: str
+    encrypted_aes_initial_vector: str
+
+class UnwrapBatchRequest(BaseModel):
+    items: List[UnwrapRequest]
+
+class ListAccessibleRequest(BaseModel):
+    cursor: Optional[str] = None
+    limit: int = 100
+
 # === Utilities ===
 def send_otp_to_email(receiver_email, otp_code):
     subject = 'Your 2FA Code'
@@ -75,12 +159,11 @@ def send_otp_to_email(receiver_email, otp_code):
     msg['Subject'] = subject
     msg['From'] = SENDER_EMAIL
     msg['To'] = receiver_email
-    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-        server.ehlo()
-        server.starttls()
-        server.ehlo()
-        server.login(SENDER_EMAIL, SENDER_PASS)
-        server.sendmail(SENDER_EMAIL, receiver_email, msg.as_string())
+    mail_outbox.enqueue(receiver_email, msg.as_string())
+
+def gen_rsa_pair():
+    # Runs inside a key pool worker process; returns base64 PEMs so only strings cross the process boundary
+    return ALGORITHMS["rsa-2048"].generate()
 
 def gen_otp():
     return str(random.randint(100000, 999999))
@@ -91,155 +174,921 @@ def gen_sid():
     return sid
 
 # === Redis-backed operations ===
-def save_pending(email, pw, otp):
+async def save_pending(email, pw, otp):
     key = f"pending:{email}"
-    r.hmset(key, {"password_hash": pw, "otp": otp})
-    r.expire(key, 600)
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping={"password_hash": pw, "otp": otp})
+        pipe.expire(key, 600)
+        await pipe.execute()
 
-def get_pending(email):
-    key = f"pending:{email}"
-    if not r.exists(key): return None
-    return r.hgetall(key)
+async def get_pending(email):
+    return await r.hgetall(f"pending:{email}") or None
+
+async def get_user_password_hash(email):
+    pw = await r.hget(f"user:{email}", "password_hash")
+    return pw.decode() if pw else None
+
+async def user_or_pending_exists(email):
+    return await r.exists(f"user:{email}", f"pending:{email}") > 0
+
+async def clear_pending(email):
+    await r.delete(f"pending:{email}")
+
+async def activate_user(email, pw):
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.hset(f"user:{email}", "password_hash", pw)
+        pipe.delete(f"pending:{email}")
+        await pipe.execute()
+
+async def open_session(sid, email):
+    # session:{sid} holds just the email with its own TTL; user_sessions:{email}
+    # indexes the user's sids for "log out everywhere", scored by when each one
+    # expires. Sessions that lapsed on their own are pruned here, so the index
+    # only grows with the sessions that are still alive.
+    index = f"user_sessions:{email}"
+    now = int(time.time())
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.set(f"session:{sid}", email, ex=SESSION_TTL)
+        pipe.zremrangebyscore(index, "-inf", now)
+        pipe.zadd(index, {sid: now + SESSION_TTL})
+        pipe.expire(index, SESSION_TTL)
+        pipe.delete(f"pending:{email}")
+        await pipe.execute()
+
+async def save_file_keys(fname, pub, priv, owner, algorithm, token):
+    """Stores the key pair if `token` still holds the name's reservation; returns False if the lease was lost."""
+    keys = [f"reserve:{fname}", f"file:{fname}", f"access:{fname}", f"user_files:{owner}"]
+    return await save_file_keys_script(keys=keys, args=[token, pub, priv, owner, algorithm, fname]) == 1
+
+async def release_reservation(fname, token):
+    await release_reservation_script(keys=[f"reserve:{fname}"], args=[token])
+
+# === Redis scripts ===
+# user_files:{email} is the reverse ACL index: a zset (all scores 0, so ordered
+# by name) of every file the user can open. Every script that adds to an
+# access:{name} set also adds the name to the grantee's index in the same
+# atomic step, so the two never disagree under concurrent grants.
+# Each protected endpoint resolves the session and runs its checks in a single
+# round trip. Scripts start with SESSION_LUA, which returns {0} for an unknown
+# sid and otherwise leaves the caller's email in `email`. KEYS[1] is always
+# session:{sid}, ARGV[1] the sliding TTL ('0' disables renewal) and ARGV[2] the
+# email of an already verified session token ('' for Redis sessions). Renewing
+# also moves the session's expiry in the user's session index and pushes out
+# the index itself so it never expires before a session.
+# Some keys a script touches are only known inside it (user_sessions:{email}
+# from the session, grantees' user_files:{email} from an ACL set, and the
+# change log), so they are not all declared in KEYS. The scripts therefore
+# need a single Redis server, not Redis Cluster.
+SESSION_LUA = """
+local email = ARGV[2]
+if email == '' then
+  email = redis.call('GET', KEYS[1])
+  if not email then return {0} end
+  if ARGV[1] ~= '0' then
+    local index = 'user_sessions:' .. email
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    redis.call('ZADD', index, redis.call('TIME')[1] + ARGV[1], string.sub(KEYS[1], 9))
+    redis.call('EXPIRE', index, ARGV[1])
+  end
+end
+"""
+
+# Grants are recorded in the change log shared with the Data Server (changelog.py)
+CHANGELOG_MAX = int(os.getenv('CHANGELOG_MAX', 100000))
+CHANGELOG_LUA = changelog_lua(CHANGELOG_MAX)
+
+# KEYS: session:{sid}; ARGV: ttl, '', sid, everywhere  -> {0} | {1, email, sessions_closed}
+LOGOUT_LUA = SESSION_LUA + """
+local index = 'user_sessions:' .. email
+if ARGV[4] == '1' then
+  redis.call('ZREMRANGEBYSCORE', index, '-inf', redis.call('TIME')[1])
+  local sids = redis.call('ZRANGE', index, 0, -1)
+  for _, s in ipairs(sids) do redis.call('DEL', 'session:' .. s) end
+  redis.call('DEL', KEYS[1], index)
+  return {1, email, #sids}
+end
+redis.call('DEL', KEYS[1])
+redis.call('ZREM', index, ARGV[3])
+return {1, email, 1}
+"""
+
+# Key creation is single-flight per file name: the check reserves the name
+# with SET NX and a short lease before any CPU is spent on key generation, so
+# a concurrent request for the same name fails fast with file_exists. The key
+# pair is only written while the reservation is still held.
+# KEYS: session:{sid}, file:{name}, reserve:{name}; ARGV: ttl, email, token, lease_ms
+#   -> {0} | {1, email} exists or reserved | {2, email} reserved for us
+PUBLIC_KEY_CHECK_LUA = SESSION_LUA + """
+if redis.call('EXISTS', KEYS[2]) == 1 then return {1, email} end
+if not redis.call('SET', KEYS[3], ARGV[3], 'NX', 'PX', ARGV[4]) then return {1, email} end
+return {2, email}
+"""
+
+# KEYS: reserve:{name}, file:{name}, access:{name}, user_files:{owner}
+# ARGV: token, public_key, private_key, owner, algorithm, name  -> 1 saved | 0 lease lost
+SAVE_FILE_KEYS_LUA = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then return 0 end
+redis.call('HSET', KEYS[2], 'public_key', ARGV[2], 'private_key', ARGV[3], 'owner', ARGV[4], 'algorithm', ARGV[5])
+redis.call('SADD', KEYS[3], ARGV[4])
+redis.call('ZADD', KEYS[4], 0, ARGV[6])
+redis.call('DEL', KEYS[1])
+return 1
+"""
+
+# KEYS: reserve:{name}; ARGV: token
+RELEASE_RESERVATION_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then redis.call('DEL', KEYS[1]) end
+return 1
+"""
+
+# KEYS: session:{sid}, access:{name}, file:{name}  -> {0} | {1, email} denied | {2, email, {private_key, algorithm}}
+PRIVATE_KEY_LUA = SESSION_LUA + """
+if redis.call('SISMEMBER', KEYS[2], email) == 0 then return {1, email} end
+return {2, email, redis.call('HMGET', KEYS[3], 'private_key', 'algorithm')}
+"""
+
+# KEYS: session:{sid}, file:{name}, access:{name}; ARGV: ttl, email, friend, name  -> {0} | {1, email} not owner | {2, email} granted
+GRANT_ACCESS_LUA = CHANGELOG_LUA + SESSION_LUA + """
+if redis.call('HGET', KEYS[2], 'owner') ~= email then return {1, email} end
+redis.call('SADD', KEYS[3], ARGV[3])
+redis.call('ZADD', 'user_files:' .. ARGV[3], 0, ARGV[4])
+log_change('grant', ARGV[4])
+return {2, email}
+"""
+
+# KEYS: session:{sid}, then access:{name}, file:{name} per file
+#   -> {0} | {1, email, r1, r2, ...} where ri is {private_key, algorithm}, or 0 if denied
+PRIVATE_KEYS_LUA = SESSION_LUA + """
+local out = {1, email}
+for i = 2, #KEYS, 2 do
+  if redis.call('SISMEMBER', KEYS[i], email) == 1 then
+    out[#out + 1] = redis.call('HMGET', KEYS[i + 1], 'private_key', 'algorithm')
+  else
+    out[#out + 1] = 0
+  end
+end
+return out
+"""
+
+# KEYS: session:{sid}, then file:{name}, access:{name} per file; ARGV: ttl, email, n_files, name..., friend...
+#   -> {0} | {1, email, g1, g2, ...} where gi is 1 if granted, 0 if the caller does not own the file
+GRANT_ACCESS_BATCH_LUA = CHANGELOG_LUA + SESSION_LUA + """
+local out = {1, email}
+local n = tonumber(ARGV[3])
+for i = 2, #KEYS, 2 do
+  if redis.call('HGET', KEYS[i], 'owner') == email then
+    local name = ARGV[3 + i / 2]
+    for j = 4 + n, #ARGV do
+      redis.call('SADD', KEYS[i + 1], ARGV[j])
+      redis.call('ZADD', 'user_files:' .. ARGV[j], 0, name)
+    end
+    log_change('grant', name)
+    out[#out + 1] = 1
+  else
+    out[#out + 1] = 0
+  end
+end
+return out
+"""
+
+# The key pair, the ACL and every user's user_files entry go together; the
+# keys are UNLINKed so Redis frees them in the background. The listing change
+# is logged by the Data Server, which owns the file listing.
+# KEYS: session:{sid}, file:{name}, access:{name}; ARGV: ttl, email, name
+#   -> {0} | {1, email} not the owner (or no such file) | {2, email} deleted
+DELETE_FILE_LUA = SESSION_LUA + """
+if redis.call('HGET', KEYS[2], 'owner') ~= email then return {1, email} end
+for _, user in ipairs(redis.call('SMEMBERS', KEYS[3])) do
+  redis.call('ZREM', 'user_files:' .. user, ARGV[3])
+end
+redis.call('UNLINK', KEYS[2], KEYS[3])
+return {2, email}
+"""
+
+# KEYS: session:{sid}; ARGV: ttl, email, start, limit  -> {0} | {1, email, {name, ...}}
+ACCESSIBLE_FILES_LUA = SESSION_LUA + """
+return {1, email, redis.call('ZRANGEBYLEX', 'user_files:' .. email, ARGV[3], '+', 'LIMIT', 0, ARGV[4])}
+"""
+
+logout_script = r.register_script(LOGOUT_LUA)
+public_key_check_script = r.register_script(PUBLIC_KEY_CHECK_LUA)
+save_file_keys_script = r.register_script(SAVE_FILE_KEYS_LUA)
+release_reservation_script = r.register_script(RELEASE_RESERVATION_LUA)
+private_key_script = r.register_script(PRIVATE_KEY_LUA)
+grant_access_script = r.register_script(GRANT_ACCESS_LUA)
+private_keys_script = r.register_script(PRIVATE_KEYS_LUA)
+grant_access_batch_script = r.register_script(GRANT_ACCESS_BATCH_LUA)
+accessible_files_script = r.register_script(ACCESSIBLE_FILES_LUA)
+delete_file_script = r.register_script(DELETE_FILE_LUA)
+
+def key_entry(res):
+    """Decodes an HMGET private_key/algorithm reply; None when access was denied or the key is gone."""
+    if not isinstance(res, list) or res[0] is None:
+        return None
+    priv, algorithm = res
+    return priv.decode(), algorithm.decode() if algorithm else DEFAULT_ALGORITHM
+
+async def run_session_script(script, sid, keys=(), args=()):
+    """Run a SESSION_LUA script; returns (status, email, *rest) with email decoded."""
+    if not sid:
+        return (0,)
+    email = ""
+    if session_tokens:
+        email = await session_tokens.verify(sid)
+        if not email:
+            return (0,)
+    ttl = SESSION_TTL if SESSION_SLIDING else 0
+    res = await script(keys=[f"session:{sid}", *keys], args=[ttl, email, *args])
+    if res[0] == 0:
+        return (0,)
+    return (res[0], res[1].decode(), *res[2:])
+
+# === RSA key pool ===
+class KeyPool:
+    """Bounded pool of pre-generated RSA key pairs.
+
+    Worker processes refill the pool up to `high` whenever it drops below `low`.
+    `take()` pops a ready pair in O(1) and only generates one (still off the
+    event loop) when the pool is empty.
+    """
+
+    def __init__(self, low, high, workers):
+        self.low = low
+        self.high = max(high, low)
+        self.workers = max(workers, 1)
+        self.keys = deque()
+        self.executor = None
+        self.refill_needed = None
+        self.task = None
+        self.generated = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.refill_times = deque(maxlen=1024)
+
+    def start(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.refill_needed = asyncio.Event()
+        self.refill_needed.set()
+        self.task = asyncio.create_task(self._refill_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.task
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _generate(self):
+        loop = asyncio.get_running_loop()
+        pair = await loop.run_in_executor(self.executor, gen_rsa_pair)
+        self.generated += 1
+        self.refill_times.append(time.monotonic())
+        return pair
+
+    async def _refill_loop(self):
+        while True:
+            await self.refill_needed.wait()
+            self.refill_needed.clear()
+            while len(self.keys) < self.high:
+                batch = min(self.workers, self.high - len(self.keys))
+                results = await asyncio.gather(*(self._generate() for _ in range(batch)), return_exceptions=True)
+                for pair in results:
+                    if isinstance(pair, Exception):
+                        self.errors += 1
+                        log(f"[KEY_POOL] Key generation failed: {pair!r}")
+                    elif len(self.keys) < self.high:
+                        self.keys.append(pair)
+                if all(isinstance(pair, Exception) for pair in results):
+                    await asyncio.sleep(1)
+
+    async def take(self):
+        try:
+            pair = self.keys.popleft()
+            self.hits += 1
+        except IndexError:
+            self.misses += 1
+            pair = await self._generate()
+        if len(self.keys) < self.low and self.refill_needed:
+            self.refill_needed.set()
+        return pair
 
-def get_user_password_hash(email):
-    key = f"user:{email}"
-    if not r.exists(key): return None
-    return r.hget(key, "password_hash").decode()
+    def stats(self):
+        now = time.monotonic()
+        recent = sum(1 for t in self.refill_times if now - t <= 60)
+        return {
+            "depth": len(self.keys),
+            "low_watermark": self.low,
+            "high_watermark": self.high,
+            "workers": self.workers,
+            "generated": self.generated,
+            "refill_rate_per_sec": round(recent / 60, 3),
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
 
-def clear_pending(email):
-    r.delete(f"pending:{email}")
+key_pool = KeyPool(KEY_POOL_LOW, KEY_POOL_HIGH, KEY_POOL_WORKERS)
 
-def save_user(email, pw):
-    key = f"user:{email}"
-    r.hset(key, "password_hash", pw)
+# === Password hashing pool ===
+class PoolBusy(Exception):
+    pass
 
-def get_user(email):
-    key = f"user:{email}"
-    if not r.exists(key): return None
-    return r.hgetall(key)
+class PasswordPool:
+    """Dedicated thread pool for bcrypt work (bcrypt releases the GIL while hashing).
 
-def save_session(sid, email):
-    r.hset("sessions", sid, email)
-    r.expire("sessions", 1800)
+    At most `queue_limit` jobs may be queued or running; beyond that callers get
+    `PoolBusy` so the endpoint can answer 503 instead of queueing forever.
+    """
 
-def get_session(sid):
-    return r.hget("sessions", sid)
+    def __init__(self, workers, queue_limit, rounds):
+        self.executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="bcrypt")
+        self.workers = max(workers, 1)
+        self.queue_limit = queue_limit
+        self.rounds = rounds
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.compute_total = 0.0
 
-def save_file_keys(fname, pub, priv, owner):
-    key = f"file:{fname}"
-    r.hmset(key, {"public_key": pub, "private_key": priv, "owner": owner})
+    async def _run(self, fn, *args):
+        if self.pending >= self.queue_limit:
+            self.rejected += 1
+            raise PoolBusy()
+        self.pending += 1
+        submitted = time.monotonic()
 
-def file_exists(fname):
-    return r.exists(f"file:{fname}")
+        def job():
+            started = time.monotonic()
+            result = fn(*args)
+            return result, started - submitted, time.monotonic() - started
 
-def save_access(fname, email):
-    r.sadd(f"access:{fname}", email)
+        try:
+            loop = asyncio.get_running_loop()
+            result, waited, computed = await loop.run_in_executor(self.executor, job)
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self.compute_total += computed
+        return result
 
-def has_access(fname, email):
-    return r.sismember(f"access:{fname}", email)
+    async def hash(self, password):
+        hashed = await self._run(bcrypt.hashpw, password.encode(), bcrypt.gensalt(self.rounds))
+        return hashed.decode()
+
+    async def check(self, password, stored_hash):
+        return await self._run(bcrypt.checkpw, password.encode(), stored_hash.encode())
+
+    def stats(self):
+        done = self.completed or 1
+        return {
+            "workers": self.workers,
+            "rounds": self.rounds,
+            "pending": self.pending,
+            "queue_limit": self.queue_limit,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.wait_total / done * 1000, 2),
+            "max_wait_ms": round(self.wait_max * 1000, 2),
+            "avg_compute_ms": round(self.compute_total / done * 1000, 2),
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+password_pool = PasswordPool(PASSWORD_WORKERS, PASSWORD_QUEUE_LIMIT, BCRYPT_ROUNDS)
+
+# === Parsed private key cache ===
+class KeyCache:
+    """Bounded LRU of loaded private keys (see key_algorithms.py) keyed by the stored base64 PEM.
+
+    Keying by the PEM itself means a replaced key can never be served stale;
+    repeated unwraps skip base64 decoding and PEM parsing. Safe to use from
+    worker threads.
+    """
+
+    def __init__(self, size):
+        self.size = max(size, 1)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, priv_b64, algorithm):
+        with self.lock:
+            cipher = self.entries.get(priv_b64)
+            if cipher is not None:
+                self.entries.move_to_end(priv_b64)
+                self.hits += 1
+                return cipher
+            self.misses += 1
+        cipher = get_algorithm(algorithm).load(priv_b64)
+        with self.lock:
+            self.entries[priv_b64] = cipher
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return cipher
+
+    def stats(self):
+        return {"size": len(self.entries), "capacity": self.size, "hits": self.hits, "misses": self.misses}
+
+key_cache = KeyCache(UNWRAP_CACHE_SIZE)
+
+def unwrap_items(items, keys):
+    # Runs in a worker thread: decrypts the wrapped AES key and IV for every item
+    results = []
+    for item in items:
+        entry = keys.get(item.file_name)
+        if entry is None:
+            results.append({"file_name": item.file_name, "message": "access_denied"})
+            continue
+        try:
+            cipher = key_cache.get(*entry)
+            aes_key = cipher.decrypt(base64.b64decode(item.encrypted_aes_key))
+            iv = cipher.decrypt(base64.b64decode(item.encrypted_aes_initial_vector))
+        except (ValueError, TypeError):
+            results.append({"file_name": item.file_name, "message": "unwrap_failed"})
+            continue
+        results.append({
+            "file_name": item.file_name,
+            "aes_key": base64.b64encode(aes_key).decode(),
+            "aes_initial_vector": base64.b64encode(iv).decode(),
+        })
+    return results
+
+async def unwrap(sid, items):
+    """Session + ACL + key fetch in one script call, then decrypt off the loop; returns (user, results) or None."""
+    names = list(dict.fromkeys(item.file_name for item in items))
+    keys = [k for name in names for k in (f"access:{name}", f"file:{name}")]
+    status, *rest = await run_session_script(private_keys_script, sid, keys=keys)
+    if status == 0:
+        return None
+    entries = {name: key_entry(res) for name, res in zip(names, rest[1:])}
+    results = await asyncio.to_thread(unwrap_items, items, entries)
+    return rest[0], results
+
+# === Signed session tokens ===
+session_tokens = None
+if SESSION_MODE == "token":
+    session_tokens = SessionTokens(SESSION_SECRET, r, SESSION_TTL, refresh=REVOCATION_REFRESH, log=log)
+
+def server_busy():
+    return JSONResponse(status_code=503, content={"code": 503, "message": "server_busy"})
+
+@app.on_event("startup")
+async def start_workers():
+    key_pool.start()
+    mail_outbox.start()
+    if session_tokens:
+        session_tokens.start()
+
+@app.on_event("shutdown")
+async def stop_workers():
+    await key_pool.stop()
+    await mail_outbox.stop()
+    if session_tokens:
+        await session_tokens.stop()
+    await redis_pool.disconnect()
+    password_pool.shutdown()
+
+# === OTP mail outbox ===
+class MailOutbox:
+    """Asynchronous outbox for OTP mail.
+
+    Handlers enqueue a message and return right away. `pool_size` sender tasks
+    each keep one authenticated SMTP session open and reuse it for every
+    message, reconnecting when the relay drops it. Failed deliveries are
+    retried with exponential backoff up to `max_attempts` times.
+    """
+
+    def __init__(self, pool_size, max_attempts, retry_base):
+        self.pool_size = max(pool_size, 1)
+        self.max_attempts = max(max_attempts, 1)
+        self.retry_base = retry_base
+        self.queue = None
+        self.tasks = []
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self._sender()) for _ in range(self.pool_size)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        for task in self.tasks:
+            with suppress(asyncio.CancelledError):
+                await task
+        self.tasks = []
+
+    def enqueue(self, receiver, message):
+        self.queue.put_nowait((receiver, message, time.monotonic(), 1))
+
+    @staticmethod
+    def _connect():
+        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=30)
+        server.ehlo()
+        if SMTP_STARTTLS:
+            server.starttls()
+            server.ehlo()
+        if SENDER_PASS:
+            server.login(SENDER_EMAIL, SENDER_PASS)
+        return server
+
+    @staticmethod
+    def _close(server):
+        with suppress(smtplib.SMTPException, OSError):
+            server.quit()
+
+    def _deliver(self, server, receiver, message):
+        # Runs in a worker thread; returns the (possibly reconnected) session for reuse
+        if server is None:
+            server = self._connect()
+        try:
+            server.sendmail(SENDER_EMAIL, receiver, message)
+        except smtplib.SMTPServerDisconnected:
+            server = self._connect()
+            server.sendmail(SENDER_EMAIL, receiver, message)
+        return server
+
+    async def _sender(self):
+        server = None
+        try:
+            while True:
+                receiver, message, enqueued, attempt = await self.queue.get()
+                try:
+                    server = await asyncio.to_thread(self._deliver, server, receiver, message)
+                except (smtplib.SMTPException, OSError) as e:
+                    if server is not None:
+                        await asyncio.to_thread(self._close, server)
+                        server = None
+                    if attempt < self.max_attempts:
+                        self.retries += 1
+                        delay = self.retry_base * 2 ** (attempt - 1)
+                        log(f"[EMAIL] Delivery to {receiver} failed ({e!r}), retry {attempt} in {delay}s")
+                        asyncio.get_running_loop().call_later(
+                            delay, self.queue.put_nowait, (receiver, message, enqueued, attempt + 1))
+                    else:
+                        self.failed += 1
+                        log(f"[EMAIL] Delivery to {receiver} failed after {attempt} attempts: {e!r}")
+                except Exception as e:
+                    # Not a relay problem (e.g. an address smtplib cannot encode), so
+                    # retrying will not help; drop the message but keep this sender alive
+                    if server is not None:
+                        await asyncio.to_thread(self._close, server)
+                        server = None
+                    self.failed += 1
+                    log(f"[EMAIL] Delivery to {receiver} failed: {e!r}")
+                else:
+                    latency = time.monotonic() - enqueued
+                    self.sent += 1
+                    self.latency_total += latency
+                    self.latency_max = max(self.latency_max, latency)
+                finally:
+                    self.queue.task_done()
+        finally:
+            if server is not None:
+                self._close(server)
+
+    def stats(self):
+        sent = self.sent or 1
+        return {
+            "queued": self.queue.qsize() if self.queue else 0,
+            "sessions": self.pool_size,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "avg_latency_ms": round(self.latency_total / sent * 1000, 2),
+            "max_latency_ms": round(self.latency_max * 1000, 2),
+        }
+
+mail_outbox = MailOutbox(SMTP_POOL_SIZE, MAIL_MAX_ATTEMPTS, MAIL_RETRY_BASE)
 
 # === Endpoints ===
 @app.post("/register")
 async def register(req: RegisterRequest):
-    if get_user(req.email) or r.exists(f"pending:{req.email}"):
+    # SMTP without SMTPUTF8 can only carry ASCII addresses
+    if not req.email.isascii() or "@" not in req.email:
+        log(f"[REGISTER] Invalid email {req.email!r} (status_code: 400)")
+        return JSONResponse(content={"code": 400, "message": "invalid_email"})
+    if await user_or_pending_exists(req.email):
         log(f"[REGISTER] User {req.email} already exists (status_code: 400)")
         return JSONResponse(content={"code": 400, "message": "user_exists"})
-    password_hash = bcrypt.hashpw(req.password.encode(), bcrypt.gensalt()).decode()
+    try:
+        password_hash = await password_pool.hash(req.password)
+    except PoolBusy:
+        log(f"[REGISTER] Password pool saturated for {req.email} (status_code: 503)")
+        return server_busy()
     otp = gen_otp()
-    save_pending(req.email, password_hash, otp)
+    await save_pending(req.email, password_hash, otp)
     log(f"[EMAIL] Sending verification OTP to {req.email}: {otp}")
     send_otp_to_email(req.email, otp)
-    log(f"[REGISTER] OTP sent to {req.email}: {otp}")
+    log(f"[REGISTER] OTP queued for {req.email}: {otp}")
     return JSONResponse(content={"code": 200, "message": "registration_pending"})
 
 @app.post("/verify_register")
 async def verify_register(req: OTPVerifyRequest):
-    pending = get_pending(req.email)
+    pending = await get_pending(req.email)
     if not pending: # should not happen
         return JSONResponse(content={"code": 400, "message": "no_pending_registration"})
     if pending[b"otp"].decode() != req.otp:
-        clear_pending(req.email)
+        await clear_pending(req.email)
         log(f"[EMAIL] OTP invalid for {req.email} (status_code: 401) - clear pending")
         return JSONResponse(content={"code": 401, "message": "otp_failed"})
-    save_user(req.email, pending[b"password_hash"].decode())
-    clear_pending(req.email)
+    await activate_user(req.email, pending[b"password_hash"].decode())
     log(f"[REGISTER] User {req.email} verified (status_code: 200)")
     return JSONResponse(content={"code": 200, "message": "registration_success"})
 
 @app.post("/login")
 async def login(req: LoginRequest):
-    stored_hash = get_user_password_hash(req.email)
-    if not stored_hash or not bcrypt.checkpw(req.password.encode(), stored_hash.encode()):
+    stored_hash = await get_user_password_hash(req.email)
+    try:
+        verified = bool(stored_hash) and await password_pool.check(req.password, stored_hash)
+    except PoolBusy:
+        log(f"[LOGIN] Password pool saturated for {req.email} (status_code: 503)")
+        return server_busy()
+    if not verified:
         log(f"[LOGIN] Login failed for {req.email} (status_code: 401)")
         return JSONResponse(content={"code": 401, "message": "login_failed"})
     otp = gen_otp()
-    save_pending(req.email, stored_hash, otp)
+    await save_pending(req.email, stored_hash, otp)
     log(f"[EMAIL] Login OTP to {req.email}: {otp}")
     send_otp_to_email(req.email, otp)
-    log(f"[LOGIN] OTP sent to {req.email}: {otp}")
+    log(f"[LOGIN] OTP queued for {req.email}: {otp}")
     return JSONResponse(content={"code": 200, "message": "login_otp_sent"})
 
 @app.post("/verify_login")
 async def verify_login(req: OTPVerifyRequest):
-    pending = get_pending(req.email)
+    pending = await get_pending(req.email)
     if not pending or pending[b"otp"].decode() != req.otp:
         log(f"[LOGIN] OTP failed for {req.email} (status_code: 401)")
         return JSONResponse(content={"code": 401, "message": "otp_failed"})
-    sid = gen_sid()
-    save_session(sid, req.email)
-    clear_pending(req.email)
+    if session_tokens:
+        sid = session_tokens.issue(req.email)
+        await clear_pending(req.email)
+    else:
+        sid = gen_sid()
+        await open_session(sid, req.email)
     log(f"[LOGIN] Login success for {req.email} (status_code: 200)")
     return JSONResponse(content={"code": 200, "message": "login_success", "sid": sid})
 
+@app.post("/logout")
+async def logout(sid: Optional[str] = Header(None)):
+    if session_tokens:
+        user = await session_tokens.verify(sid)
+        if user:
+            await session_tokens.revoke(sid)
+    else:
+        status, *rest = await run_session_script(logout_script, sid, args=[sid, 0])
+        user = rest[0] if status else None
+    if not user:
+        log(f"[LOGOUT] Invalid session for {sid} (status_code: 403)")
+        return JSONResponse(content={"code": 403, "message": "invalid_session"})
+    log(f"[LOGOUT] Session {sid} closed for {user} (status_code: 200)")
+    return JSONResponse(content={"code": 200, "message": "logout_success"})
+
+@app.post("/logout_all")
+async def logout_all(sid: Optional[str] = Header(None)):
+    closed = None
+    if session_tokens:
+        # Tokens cannot be enumerated; revoking the user kills every token issued so far
+        user = await session_tokens.verify(sid)
+        if user:
+            await session_tokens.revoke_user(user)
+    else:
+        status, *rest = await run_session_script(logout_script, sid, args=[sid, 1])
+        user, closed = rest if status else (None, None)
+    if not user:
+        log(f"[LOGOUT_ALL] Invalid session for {sid} (status_code: 403)")
+        return JSONResponse(content={"code": 403, "message": "invalid_session"})
+    log(f"[LOGOUT_ALL] Closed sessions for {user} (status_code: 200)")
+    return JSONResponse(content={"code": 200, "message": "logout_success", "sessions_closed": closed})
+
 @app.post("/get_public_key")
-async def get_public_key(req: FileNameRequest, sid: Optional[str] = Header(None)):
-    if not get_session(sid):
+async def get_public_key(req: PublicKeyRequest, sid: Optional[str] = Header(None)):
+    algorithm = req.algorithm or KEY_ALGORITHM
+    if algorithm not in ALGORITHMS:
+        log(f"[GET_PUBLIC_KEY] Unsupported algorithm {algorithm} for {req.file_name} (status_code: 400)")
+        return JSONResponse(content={"code": 400, "message": "unsupported_algorithm"})
+    token = secrets.token_hex(8)
+    status, *rest = await run_session_script(
+        public_key_check_script, sid,
+        keys=[f"file:{req.file_name}", f"reserve:{req.file_name}"], args=[token, RESERVATION_LEASE_MS])
+    if status == 0:
         log(f"[GET_PUBLIC_KEY] Invalid session for {sid} (status_code: 403)")
         return JSONResponse(content={"code": 403, "message": "invalid_session"})
-    if file_exists(req.file_name):
-        log(f"[GET_PUBLIC_KEY] File {req.file_name} already exists (status_code: 400)")
+    if status == 1:
+        log(f"[GET_PUBLIC_KEY] File {req.file_name} already exists or is being created (status_code: 400)")
+        return JSONResponse(content={"code": 400, "message": "file_exists"})
+    user = rest[0]
+    try:
+        if algorithm == "rsa-2048":
+            pub, priv = await key_pool.take()
+        else:
+            # ECC key generation is cheap enough to skip the pool (about 1-2 ms),
+            # but still too long to run on the event loop
+            pub, priv = await asyncio.to_thread(ALGORITHMS[algorithm].generate)
+        saved = await save_file_keys(req.file_name, pub, priv, user, algorithm, token)
+    except BaseException:
+        await release_reservation(req.file_name, token)
+        raise
+    if not saved:
+        log(f"[GET_PUBLIC_KEY] Reservation on {req.file_name} expired before the key was saved (status_code: 400)")
         return JSONResponse(content={"code": 400, "message": "file_exists"})
-    rsa_key = RSA.generate(2048)
-    pub = base64.b64encode(rsa_key.publickey().export_key()).decode()
-    priv = base64.b64encode(rsa_key.export_key()).decode()
-    user = get_session(sid).decode()
-    save_file_keys(req.file_name, pub, priv, user)
-    save_access(req.file_name, user)
-    log(f"[GET_PUBLIC_KEY] Public key saved for {req.file_name} (status_code: 200)")
-    return JSONResponse(content={"code": 200, "message": "public_key_saved", "kms_public_key": pub})
+    log(f"[GET_PUBLIC_KEY] {algorithm} public key saved for {req.file_name} (status_code: 200)")
+    return JSONResponse(content={
+        "code": 200,
+        "message": "public_key_saved",
+        "kms_public_key": pub,
+        "algorithm": algorithm,
+    })
 
 @app.post("/get_private_key")
 async def get_private_key(req: FileNameRequest, sid: Optional[str] = Header(None)):
-    if not get_session(sid):
+    status, *rest = await run_session_script(
+        private_key_script, sid, keys=[f"access:{req.file_name}", f"file:{req.file_name}"])
+    if status == 0:
         log(f"[GET_PRIVATE_KEY] Invalid session for {sid} (status_code: 403)")
         return JSONResponse(content={"code": 403, "message": "invalid_session"})
-    user = get_session(sid).decode()
-    if not has_access(req.file_name, user):
+    user = rest[0]
+    entry = key_entry(rest[1]) if status == 2 else None
+    if entry is None:
         log(f"[GET_PRIVATE_KEY] Access denied for {user} on {req.file_name} (status_code: 400)")
         return JSONResponse(content={"code": 400, "message": "access_denied"})
-    key = r.hget(f"file:{req.file_name}", "private_key").decode()
+    key, algorithm = entry
     log(f"[GET_PRIVATE_KEY] Private key retrieved for {req.file_name} (status_code: 200)")
-    return JSONResponse(content={"code": 200, "message": "private_key_retrieved", "kms_private_key": key})
+    return JSONResponse(content={
+        "code": 200,
+        "message": "private_key_retrieved",
+        "kms_private_key": key,
+        "algorithm": algorithm,
+    })
+
+@app.post("/get_private_keys")
+async def get_private_keys(req: FileNamesRequest, sid: Optional[str] = Header(None)):
+    names = list(dict.fromkeys(req.file_names))
+    if len(names) > BATCH_MAX:
+        log(f"[GET_PRIVATE_KEYS] Batch of {len(names)} exceeds {BATCH_MAX} (status_code: 400)")
+        return JSONResponse(content={"code": 400, "message": "batch_too_large", "max_batch": BATCH_MAX})
+    keys = [k for name in names for k in (f"access:{name}", f"file:{name}")]
+    status, *rest = await run_session_script(private_keys_script, sid, keys=keys)
+    if status == 0:
+        log(f"[GET_PRIVATE_KEYS] Invalid session for {sid} (status_code: 403)")
+        return JSONResponse(content={"code": 403, "message": "invalid_session"})
+    user, results = rest[0], rest[1:]
+    found, algorithms, errors = {}, {}, {}
+    for name, res in zip(names, results):
+        entry = key_entry(res)
+        if entry:
+            found[name], algorithms[name] = entry
+        else:
+            errors[name] = "access_denied"
+    log(f"[GET_PRIVATE_KEYS] {len(found)} keys retrieved, {len(errors)} denied for {user} (status_code: 200)")
+    return JSONResponse(content={
+        "code": 200,
+        "message": "private_keys_retrieved",
+        "kms_private_keys": found,
+        "algorithms": algorithms,
+        "errors": errors,
+    })
+
+@app.post("/unwrap")
+async def unwrap_key(req: UnwrapRequest, sid: Optional[str] = Header(None)):
+    res = await unwrap(sid, [req])
+    if res is None:
+        log(f"[UNWRAP] Invalid session for {sid} (status_code: 403)")
+        return JSONResponse(content={"code": 403, "message": "invalid_session"})
+    user, (result,) = res
+    if "message" in result:
+        log(f"[UNWRAP] {result['message']} for {user} on {req.file_name} (status_code: 400)")
+        return JSONResponse(content={"code": 400, "message": result["message"]})
+    log(f"[UNWRAP] Key unwrapped for {user} on {req.file_name} (status_code: 200)")
+    return JSONResponse(content={
+        "code": 200,
+        "message": "unwrap_success",
+        "aes_key": result["aes_key"],
+        "aes_initial_vector": result["aes_initial_vector"],
+    })
+
+@app.post("/unwrap_batch")
+async def unwrap_batch(req: UnwrapBatchRequest, sid: Optional[str] = Header(None)):
+    if len(req.items) > BATCH_MAX:
+        log(f"[UNWRAP_BATCH] Batch of {len(req.items)} exceeds {BATCH_MAX} (status_code: 400)")
+        return JSONResponse(content={"code": 400, "message": "batch_too_large", "max_batch": BATCH_MAX})
+    res = await unwrap(sid, req.items)
+    if res is None:
+        log(f"[UNWRAP_BATCH] Invalid session for {sid} (status_code: 403)")
+        return JSONResponse(content={"code": 403, "message": "invalid_session"})
+    user, results = res
+    log(f"[UNWRAP_BATCH] Unwrapped {len(results)} items for {user} (status_code: 200)")
+    return JSONResponse(content={"code": 200, "message": "unwrap_success", "results": results})
 
 @app.post("/grant_access")
 async def grant_access(req: GrantAccessRequest, sid: Optional[str] = Header(None)):
-    if not get_session(sid):
+    status, *rest = await run_session_script(
+        grant_access_script, sid,
+        keys=[f"file:{req.file_name}", f"access:{req.file_name}"], args=[req.friend_email, req.file_name])
+    if status == 0:
         log(f"[GRANT_ACCESS] Invalid session for {sid} (status_code: 403)")
         return JSONResponse(content={"code": 403, "message": "invalid_session"})
-    owner = get_session(sid).decode()
-    rec = r.hgetall(f"file:{req.file_name}")
-    if not rec or rec[b"owner"].decode() != owner:
+    owner = rest[0]
+    if status == 1:
         log(f"[GRANT_ACCESS] Permission denied for {owner} on {req.file_name} (status_code: 400)")
         return JSONResponse(content={"code": 400, "message": "permission_denied"})
-    save_access(req.file_name, req.friend_email)
     log(f"[GRANT_ACCESS] {req.friend_email} granted on {req.file_name} (status_code: 200)")
     return JSONResponse(content={"code": 200, "message": "grant_success"})
 
+@app.post("/grant_access_batch")
+async def grant_access_batch(req: GrantAccessBatchRequest, sid: Optional[str] = Header(None)):
+    names = list(dict.fromkeys(req.file_names))
+    friends = list(dict.fromkeys(req.friend_emails))
+    if len(names) * len(friends) > GRANT_BATCH_MAX:
+        log(f"[GRANT_ACCESS_BATCH] {len(names)}x{len(friends)} grants exceed {GRANT_BATCH_MAX} (status_code: 400)")
+        return JSONResponse(content={"code": 400, "message": "batch_too_large", "max_batch": GRANT_BATCH_MAX})
+    keys = [k for name in names for k in (f"file:{name}", f"access:{name}")]
+    status, *rest = await run_session_script(
+        grant_access_batch_script, sid, keys=keys, args=[len(names), *names, *friends])
+    if status == 0:
+        log(f"[GRANT_ACCESS_BATCH] Invalid session for {sid} (status_code: 403)")
+        return JSONResponse(content={"code": 403, "message": "invalid_session"})
+    owner, results = rest[0], rest[1:]
+    report = [
+        {"file_name": name, "message": "grant_success" if ok else "permission_denied"}
+        for name, ok in zip(names, results)
+    ]
+    granted = sum(results)
+    log(f"[GRANT_ACCESS_BATCH] {owner} granted {len(friends)} users on {granted}/{len(names)} files (status_code: 200)")
+    return JSONResponse(content={
+        "code": 200,
+        "message": "grant_batch_done",
+        "friend_emails": friends,
+        "results": report,
+    })
+
+@app.post("/delete_file")
+async def delete_file(req: FileNameRequest, sid: Optional[str] = Header(None)):
+    status, *rest = await run_session_script(
+        delete_file_script, sid,
+        keys=[f"file:{req.file_name}", f"access:{req.file_name}"], args=[req.file_name])
+    if status == 0:
+        log(f"[DELETE_FILE] Invalid session for {sid} (status_code: 403)")
+        return JSONResponse(content={"code": 403, "message": "invalid_session"})
+    owner = rest[0]
+    if status == 1:
+        log(f"[DELETE_FILE] Permission denied for {owner} on {req.file_name} (status_code: 400)")
+        return JSONResponse(content={"code": 400, "message": "permission_denied"})
+    log(f"[DELETE_FILE] {owner} deleted keys of {req.file_name} (status_code: 200)")
+    return JSONResponse(content={"code": 200, "message": "delete_success"})
+
+@app.post("/list_accessible_files")
+async def list_accessible_files(req: ListAccessibleRequest, sid: Optional[str] = Header(None)):
+    limit = max(1, min(req.limit, LIST_PAGE_MAX))
+    start = f"({req.cursor}" if req.cursor else "-"
+    # Ask for one extra name to learn whether another page follows
+    status, *rest = await run_session_script(accessible_files_script, sid, args=[start, limit + 1])
+    if status == 0:
+        log(f"[LIST_ACCESSIBLE] Invalid session for {sid} (status_code: 403)")
+        return JSONResponse(content={"code": 403, "message": "invalid_session"})
+    user, names = rest[0], [n.decode() for n in rest[1]]
+    next_cursor = names[limit - 1] if len(names) > limit else None
+    log(f"[LIST_ACCESSIBLE] Returning {min(len(names), limit)} files for {user} (status_code: 200)")
+    return JSONResponse(content={
+        "code": 200,
+        "message": "list_accessible_success",
+        "files": names[:limit],
+        "next_cursor": next_cursor,
+    })
+
+@app.get("/metrics")
+async def metrics():
+    return JSONResponse(content={
+        "code": 200,
+        "key_pool": key_pool.stats(),
+        "password_pool": password_pool.stats(),
+        "mail_outbox": mail_outbox.stats(),
+        "session_tokens": session_tokens.stats() if session_tokens else None,
+        "key_cache": key_cache.stats(),
+    })
+
 # === Startup ===
+async def flush_db():
+    await r.flushdb()
+    # Drop connections bound to this temporary loop before uvicorn starts its own
+    await redis_pool.disconnect()
+
 import uvicorn
 
 if __name__ == "__main__":
     log("Flushing Redis database for a clean start...")
-    r.flushdb()
+    asyncio.run(flush_db())
     log("Starting KMS Server with FastAPI on port 3000")
     uvicorn.run(app, host="0.0.0.0", port=3000)
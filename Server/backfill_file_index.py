@@ -0,0 +1,36 @@
+# backfill_file_index.py
+# One-shot build of the Data Server's file index (files_by_name,
+# files_by_time) from existing filedata:{name} records. Records without an
+# "uploaded_at" get the current time. Uses SCAN so Redis is never blocked and
+# ZADD/HSETNX so it is safe to run while the Data Server is serving uploads.
+#
+#   python3 ./backfill_file_index.py
+from dotenv import load_dotenv
+from redis import asyncio as aioredis
+import asyncio
+import os
+import time
+
+BATCH = 1000
+
+async def backfill():
+    load_dotenv()
+    r = aioredis.Redis(host=os.getenv('REDIS_HOST'), port=os.getenv('REDIS_PORT'), db=0)
+    now = int(time.time() * 1000)
+    files = 0
+    try:
+        async for key in r.scan_iter(match="filedata:*", count=BATCH):
+            fname = key.decode().split("filedata:", 1)[1]
+            await r.hsetnx(key, 'uploaded_at', now)
+            uploaded_at = int(await r.hget(key, 'uploaded_at'))
+            async with r.pipeline(transaction=False) as pipe:
+                pipe.zadd("files_by_name", {fname: 0})
+                pipe.zadd("files_by_time", {f"{uploaded_at:015d}|{fname}": 0})
+                await pipe.execute()
+            files += 1
+    finally:
+        await r.close()
+    print(f"[BACKFILL] Indexed {files} files")
+
+if __name__ == "__main__":
+    asyncio.run(backfill())
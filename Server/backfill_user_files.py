@@ -0,0 +1,34 @@
+# backfill_user_files.py
+# One-shot rebuild of the user_files:{email} reverse ACL index from the
+# existing access:{file_name} sets. Uses SCAN/SSCAN so Redis is never blocked
+# and ZADD so it is safe to run while the KMS is serving grants.
+#
+#   python3 ./backfill_user_files.py
+from dotenv import load_dotenv
+from redis import asyncio as aioredis
+import asyncio
+import os
+
+BATCH = 1000
+
+async def backfill():
+    load_dotenv()
+    r = aioredis.Redis(host=os.getenv('REDIS_HOST'), port=os.getenv('REDIS_PORT'), db=0)
+    files = entries = 0
+    try:
+        async for key in r.scan_iter(match="access:*", count=BATCH):
+            fname = key.decode().split("access:", 1)[1]
+            async with r.pipeline(transaction=False) as pipe:
+                async for email in r.sscan_iter(key, count=BATCH):
+                    pipe.zadd(f"user_files:{email.decode()}", {fname: 0})
+                    entries += 1
+                    if len(pipe) >= BATCH:
+                        await pipe.execute()
+                await pipe.execute()
+            files += 1
+    finally:
+        await r.close()
+    print(f"[BACKFILL] Indexed {entries} grants across {files} files")
+
+if __name__ == "__main__":
+    asyncio.run(backfill())
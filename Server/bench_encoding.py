@@ -0,0 +1,54 @@
+# bench_encoding.py
+# Compares the cost of encoding one /download body with each codec in
+# codec.py against the previous path (join the file, base64 it to a str,
+# json.dumps the dict, encode the result). The file arrives as the blob store
+# yields it: pieces of BLOB_READ_BUFFER bytes.
+#
+# "copied" is the peak memory allocated while encoding, in multiples of the
+# file size, i.e. roughly how many file-sized buffers one download creates
+# before the first byte reaches the socket.
+#
+#   python3 ./bench_encoding.py [size_mb] [rounds]
+import base64
+import json
+import os
+import sys
+import time
+import tracemalloc
+from codec import FAST_JSON, MSGPACK, STD_JSON
+
+READ_BUFFER = 1 << 20
+FIELDS = {"code": 200, "encrypted_aes_key": "k" * 344, "encrypted_aes_initial_vector": "v" * 344}
+
+def previous(pieces):
+    data = b"".join(pieces)
+    content = dict(FIELDS, encrypted_data=base64.b64encode(data).decode())
+    return [json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()]
+
+def measure(encode, pieces, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        parts = encode(pieces)
+    elapsed = (time.perf_counter() - start) / rounds * 1000
+    del parts
+    tracemalloc.start()
+    parts = encode(pieces)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, sum(len(part) for part in parts)
+
+def bench(size, rounds):
+    data = os.urandom(size)
+    pieces = [data[off:off + READ_BUFFER] for off in range(0, size, READ_BUFFER)]
+    encoders = {"previous": previous}
+    for codec in dict.fromkeys(c for c in (STD_JSON, FAST_JSON, MSGPACK) if c):
+        encoders[codec.name] = lambda p, codec=codec: codec.encode_with_blob(FIELDS, "encrypted_data", p)
+    print(f"{size / (1 << 20):.1f} MB file, {len(pieces)} pieces")
+    print(f"{'encoding':<12}{'ms':>10}{'copied':>10}{'body bytes':>14}")
+    for name, encode in encoders.items():
+        ms, peak, body = measure(encode, pieces, rounds)
+        print(f"{name:<12}{ms:>10.2f}{peak / size:>9.2f}x{body:>14}")
+
+if __name__ == "__main__":
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 32
+    bench(int(size_mb * (1 << 20)), int(sys.argv[2]) if len(sys.argv) > 2 else 5)
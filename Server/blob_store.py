@@ -0,0 +1,338 @@
+# blob_store.py
+# Where the Data Server keeps ciphertext bytes. Redis holds only file
+# metadata; the bytes are immutable blobs named by the SHA-256 of their
+# content, stored by one of these backends (BLOB_BACKEND):
+#
+#   fs     BLOB_DIR/ab/cd/<sha256>: written to a temp file, fsynced and
+#          os.replace()d into place, read back through mmap
+#   redis  blob:<sha256> string keys
+#
+# Lifetimes are tracked in Redis for both backends. blob_refs counts the file
+# records using each blob. blob_staging holds blobs nobody references (yet, or
+# anymore), scored by the unix time after which they may be deleted. sweep()
+# deletes expired unreferenced blobs. While it does, their ids sit in
+# blob_deleting, and an upload that produces the same content waits for the
+# deletion to finish before placing its copy.
+import asyncio
+import hashlib
+import mmap
+import os
+import secrets
+import shutil
+import time
+import uuid
+
+BLOB_REFS = "blob_refs"            # hash: blob id -> number of files using it
+BLOB_STAGING = "blob_staging"      # zset: unreferenced blob id -> deletable after (unix time)
+BLOB_DELETING = "blob_deleting"    # set: blob ids being deleted by a sweep
+SWEEP_LOCK = "blob_sweep_lock"
+# Redis backend: a partly written blob whose upload died is dropped after this
+# many seconds without a write
+TMP_BLOB_TTL = 3600
+
+# KEYS: blob_staging, blob_deleting; ARGV: blob_id, deadline -> 1 staged | 0 being deleted, retry
+STAGE_LUA = """
+if redis.call('SISMEMBER', KEYS[2], ARGV[1]) == 1 then
+  return 0
+end
+local current = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not current or tonumber(current) < tonumber(ARGV[2]) then
+  redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+end
+return 1
+"""
+
+# KEYS: blob_staging, blob_refs, blob_deleting; ARGV: now, limit -> ids to delete
+SWEEP_LUA = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local doomed = {}
+for _, id in ipairs(ids) do
+  redis.call('ZREM', KEYS[1], id)
+  if tonumber(redis.call('HGET', KEYS[2], id) or '0') <= 0 then
+    redis.call('SADD', KEYS[3], id)
+    doomed[#doomed + 1] = id
+  end
+end
+return doomed
+"""
+
+# Redis backend: stage and place in one atomic step
+# KEYS: blob_staging, blob_deleting, blob_tmp:{id}, blob:{blob_id}; ARGV: blob_id, deadline
+#   -> 1 placed | 0 being deleted, retry
+STAGE_AND_PLACE_LUA = STAGE_LUA.replace("return 1\n", "") + """
+redis.call('RENAME', KEYS[3], KEYS[4])
+redis.call('PERSIST', KEYS[4])
+return 1
+"""
+
+# KEYS: lock; ARGV: token
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+def manifest_digest(blob_ids):
+    """Digest of a file made of these blobs, in order.
+
+    A single blob's id is already the SHA-256 of the file. For several blobs it
+    is the SHA-256 of their concatenated binary ids plus "-<count>", which is
+    cheap to compute from the manifest when chunks were written in parallel.
+    """
+    if len(blob_ids) == 1:
+        return blob_ids[0]
+    combined = hashlib.sha256(b"".join(bytes.fromhex(blob_id) for blob_id in blob_ids))
+    return f"{combined.hexdigest()}-{len(blob_ids)}"
+
+class BlobWriter:
+    """Streams one blob into the store, buffering at most the store's write_buffer bytes.
+
+    finish() names the blob after its content, stages it until `ttl` seconds
+    from now and moves it into place; the caller then references it from a
+    file record (see the commit scripts in Data_Server_APIs_fastapi.py) or
+    lets the sweeper collect it.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.digest = hashlib.sha256()
+        self.buffer = bytearray()
+        self.size = 0
+        self.blob_id = None
+
+    async def write(self, data):
+        self.digest.update(data)
+        self.buffer += data
+        self.size += len(data)
+        if len(self.buffer) >= self.store.write_buffer:
+            await self._flush()
+            self.buffer.clear()
+
+    async def finish(self, ttl=None):
+        await self._flush()
+        self.buffer.clear()
+        blob_id = self.digest.hexdigest()
+        await self._stage_and_place(blob_id, self.store.deadline(ttl))
+        self.blob_id = blob_id
+        return blob_id
+
+    async def _stage_and_place(self, blob_id, deadline):
+        await self.store.stage(blob_id, deadline)
+        await self._place(blob_id)
+
+class FileBlobWriter(BlobWriter):
+    def __init__(self, store):
+        super().__init__(store)
+        self.tmp_path = os.path.join(store.tmp_dir, uuid.uuid4().hex)
+        self.file = open(self.tmp_path, "wb")
+
+    async def _flush(self):
+        if self.buffer:
+            await asyncio.to_thread(self.file.write, bytes(self.buffer))
+
+    def _sync_and_replace(self, path):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self.tmp_path, path)
+
+    async def _place(self, blob_id):
+        await asyncio.to_thread(self._sync_and_replace, self.store.path(blob_id))
+
+    async def abort(self):
+        self.file.close()
+        try:
+            os.unlink(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+class RedisBlobWriter(BlobWriter):
+    def __init__(self, store):
+        super().__init__(store)
+        self.tmp_key = f"blob_tmp:{uuid.uuid4().hex}"
+
+    async def _flush(self):
+        # Also runs for an empty buffer so that zero-length blobs exist
+        async with self.store.r.pipeline(transaction=False) as pipe:
+            pipe.append(self.tmp_key, bytes(self.buffer))
+            pipe.expire(self.tmp_key, TMP_BLOB_TTL)
+            await pipe.execute()
+
+    async def _stage_and_place(self, blob_id, deadline):
+        keys = [BLOB_STAGING, BLOB_DELETING, self.tmp_key, f"blob:{blob_id}"]
+        while not await self.store.stage_and_place_script(keys=keys, args=[blob_id, deadline]):
+            await asyncio.sleep(0.05)
+
+    async def abort(self):
+        await self.store.r.unlink(self.tmp_key)
+
+class BlobStore:
+    """Backend-independent blob lifecycle; subclasses supply writers, reads and deletes.
+
+    `r` is the Data Server's redis.asyncio client, which holds the metadata.
+    """
+
+    writer_class = None
+
+    def __init__(self, r, staging_ttl=3600, write_buffer=1 << 20, read_buffer=1 << 20,
+                 sweep_interval=60, log=print):
+        self.r = r
+        self.staging_ttl = staging_ttl
+        self.write_buffer = write_buffer
+        self.read_buffer = read_buffer
+        self.sweep_interval = sweep_interval
+        self.log = log
+        self.stage_script = r.register_script(STAGE_LUA)
+        self.sweep_script = r.register_script(SWEEP_LUA)
+        self.release_lock_script = r.register_script(RELEASE_LOCK_LUA)
+        self.stage_and_place_script = r.register_script(STAGE_AND_PLACE_LUA)
+        self.task = None
+        self.swept = 0
+
+    def writer(self):
+        return self.writer_class(self)
+
+    async def write_stream(self, stream, ttl=None):
+        """Writes an async iterable of bytes as one blob; returns the finished writer."""
+        writer = self.writer()
+        try:
+            async for chunk in stream:
+                await writer.write(chunk)
+            await writer.finish(ttl)
+        except BaseException:
+            await writer.abort()
+            raise
+        return writer
+
+    async def write_bytes(self, data, ttl=None):
+        async def single():
+            yield data
+        return await self.write_stream(single(), ttl)
+
+    def scripts(self):
+        return [self.stage_script, self.sweep_script, self.release_lock_script, self.stage_and_place_script]
+
+    def deadline(self, ttl=None):
+        return int(time.time()) + (self.staging_ttl if ttl is None else ttl)
+
+    async def stage(self, blob_id, deadline):
+        while not await self.stage_script(keys=[BLOB_STAGING, BLOB_DELETING], args=[blob_id, deadline]):
+            await asyncio.sleep(0.05)
+
+    # === Sweeping ===
+
+    async def _delete_marked(self, ids):
+        for blob_id in ids:
+            await self.delete(blob_id if isinstance(blob_id, str) else blob_id.decode())
+        if ids:
+            await self.r.srem(BLOB_DELETING, *ids)
+        self.swept += len(ids)
+
+    async def sweep(self, limit=1000):
+        """Deletes every unreferenced blob whose staging deadline has passed; returns how many."""
+        token = secrets.token_hex(8)
+        if not await self.r.set(SWEEP_LOCK, token, nx=True, px=max(1, self.sweep_interval) * 10000):
+            return 0
+        start = self.swept
+        try:
+            # Finish deletions a crashed sweep left marked
+            await self._delete_marked(list(await self.r.smembers(BLOB_DELETING)))
+            while True:
+                ids = await self.sweep_script(keys=[BLOB_STAGING, BLOB_REFS, BLOB_DELETING],
+                                              args=[int(time.time()), limit])
+                await self._delete_marked(ids)
+                if len(ids) < limit:
+                    break
+        finally:
+            await self.release_lock_script(keys=[SWEEP_LOCK], args=[token])
+        return self.swept - start
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                swept = await self.sweep()
+                if swept:
+                    self.log(f"[BLOB] Swept {swept} unreferenced blobs")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log(f"[BLOB] Sweep failed: {e!r}")
+            await asyncio.sleep(self.sweep_interval)
+
+    def start(self):
+        self.task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def stats(self):
+        async with self.r.pipeline(transaction=False) as pipe:
+            pipe.hlen(BLOB_REFS)
+            pipe.zcard(BLOB_STAGING)
+            referenced, staged = await pipe.execute()
+        return {"backend": self.name, "referenced": referenced, "staged": staged, "swept": self.swept}
+
+class FileBlobStore(BlobStore):
+    name = "fs"
+    writer_class = FileBlobWriter
+
+    def __init__(self, r, directory, **kwargs):
+        super().__init__(r, **kwargs)
+        self.directory = directory
+        self.tmp_dir = os.path.join(directory, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, blob_id):
+        return os.path.join(self.directory, blob_id[:2], blob_id[2:4], blob_id)
+
+    async def read(self, blob_id, start, end):
+        """Yields bytes start..end (inclusive) of a blob, mapped from the page cache."""
+        if end < start:
+            return
+        with open(self.path(blob_id), "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for off in range(start, end + 1, self.read_buffer):
+                # Slicing may fault pages in from disk, so keep it off the event loop
+                yield await asyncio.to_thread(mm.__getitem__, slice(off, min(off + self.read_buffer, end + 1)))
+
+    def _unlink(self, blob_id):
+        try:
+            os.unlink(self.path(blob_id))
+        except FileNotFoundError:
+            pass
+
+    async def delete(self, blob_id):
+        # Freeing a large file's extents can take a while on some filesystems
+        await asyncio.to_thread(self._unlink, blob_id)
+
+    async def clear(self):
+        await asyncio.to_thread(shutil.rmtree, self.directory, True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+class RedisBlobStore(BlobStore):
+    name = "redis"
+    writer_class = RedisBlobWriter
+
+    async def read(self, blob_id, start, end):
+        for off in range(start, end + 1, self.read_buffer):
+            yield await self.r.getrange(f"blob:{blob_id}", off, min(off + self.read_buffer - 1, end))
+
+    async def delete(self, blob_id):
+        await self.r.unlink(f"blob:{blob_id}")
+
+    async def clear(self):
+        # Blob keys live in the Data Server's Redis database, which is flushed with it
+        pass
+
+def make_blob_store(backend, r, directory="blobs", **kwargs):
+    if backend == "fs":
+        return FileBlobStore(r, directory, **kwargs)
+    if backend == "redis":
+        return RedisBlobStore(r, **kwargs)
+    raise RuntimeError(f"Unknown BLOB_BACKEND {backend!r} (expected fs or redis)")
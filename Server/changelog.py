@@ -0,0 +1,46 @@
+# changelog.py
+# Versioned log of file changes, shared by the KMS (grants) and the Data
+# Server (uploads, deletes) so clients can sync listings incrementally.
+#
+# changelog:version is a counter and changelog a stream whose entry ids are
+# "<version>-0", so versions are plain increasing integers. Entries carry an
+# "op" (upload | delete | grant) and the "file" name. The stream is trimmed to
+# about `max_len` entries; a client whose version has been trimmed away is
+# told to reset, i.e. fetch the full listing again. log_change() writes these
+# fixed keys without them being passed in KEYS, so scripts using it need a
+# single Redis server (not Redis Cluster).
+CHANGELOG = "changelog"
+CHANGELOG_VERSION = "changelog:version"
+
+def changelog_lua(max_len):
+    """Lua prelude defining log_change(op, file) for scripts that change files."""
+    return f"""
+local function log_change(op, file)
+  local version = redis.call('INCR', '{CHANGELOG_VERSION}')
+  redis.call('XADD', '{CHANGELOG}', 'MAXLEN', '~', {int(max_len)}, version .. '-0', 'op', op, 'file', file)
+end
+"""
+
+async def current_version(r):
+    return int(await r.get(CHANGELOG_VERSION) or 0)
+
+async def changes_since(r, since, limit):
+    """Returns (version, changes, reset). `changes` are at most `limit` entries
+    after `since`, oldest first, and `version` is the last one returned (or the
+    current version if there were none). `reset` means entries after `since`
+    are no longer kept."""
+    async with r.pipeline(transaction=False) as pipe:
+        pipe.get(CHANGELOG_VERSION)
+        pipe.xrange(CHANGELOG, "-", "+", count=1)
+        pipe.xrange(CHANGELOG, f"{since + 1}-0", "+", count=limit)
+        version, oldest, entries = await pipe.execute()
+    version = int(version or 0)
+    first = int(oldest[0][0].decode().split("-")[0]) if oldest else version + 1
+    if since > version or first > since + 1:
+        return version, [], since != version
+    changes = [{
+        "version": int(entry_id.decode().split("-")[0]),
+        "op": fields[b"op"].decode(),
+        "file": fields[b"file"].decode(),
+    } for entry_id, fields in entries]
+    return (changes[-1]["version"] if changes else version), changes, False
@@ -0,0 +1,130 @@
+# codec.py
+# Response encoding shared by the KMS and the Data Server.
+#
+#   json     the standard library encoder (FAST_ENCODING=0, or orjson missing)
+#   orjson   the same JSON, several times faster to produce
+#   msgpack  for clients sending "Accept: application/msgpack" (when msgpack is
+#            installed); binary fields are raw bytes instead of base64 text
+#
+# Negotiation picks a codec per request and keeps it in a context variable,
+# so every JSONResponse an endpoint returns is rendered with it. Large binary
+# fields go through encode_with_blob(), which encodes the stored pieces
+# straight into body parts instead of joining, decoding to str and
+# re-encoding them.
+import binascii
+import contextvars
+import json
+import struct
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse as StarletteJSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+def b64_pieces(pieces):
+    """Base64 of the concatenation of `pieces`, as parts, without joining the input."""
+    carry = b""
+    for piece in pieces:
+        view = memoryview(piece)
+        if carry:
+            take = 3 - len(carry)
+            carry += bytes(view[:take])
+            view = view[take:]
+            if len(carry) < 3:
+                continue
+            yield binascii.b2a_base64(carry, newline=False)
+            carry = b""
+        cut = len(view) - len(view) % 3
+        if cut:
+            yield binascii.b2a_base64(view[:cut], newline=False)
+        carry = bytes(view[cut:])
+    if carry:
+        yield binascii.b2a_base64(carry, newline=False)
+
+class StdJSON:
+    name = "json"
+    media_type = "application/json"
+
+    def dumps(self, obj):
+        # Same settings as Starlette's JSONResponse
+        return json.dumps(obj, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+    def encode_with_blob(self, fields, name, pieces):
+        """Body parts for `fields` plus a field `name` holding the bytes in `pieces` (base64 in JSON)."""
+        head = self.dumps(fields)[:-1]
+        head += b',"' if fields else b'"'
+        return [head + name.encode() + b'":"', *b64_pieces(pieces), b'"}']
+
+class FastJSON(StdJSON):
+    name = "orjson"
+
+    def dumps(self, obj):
+        return orjson.dumps(obj)
+
+class MsgPack:
+    name = "msgpack"
+    media_type = "application/msgpack"
+
+    def dumps(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def encode_with_blob(self, fields, name, pieces):
+        size = sum(len(piece) for piece in pieces)
+        # map 32 header, the fields, then a bin 32 header; the pieces follow as they are
+        head = struct.pack(">BI", 0xdf, len(fields) + 1) + b"".join(
+            self.dumps(k) + self.dumps(v) for k, v in fields.items())
+        return [head + self.dumps(name) + struct.pack(">BI", 0xc6, size), *pieces]
+
+STD_JSON = StdJSON()
+FAST_JSON = FastJSON() if orjson else STD_JSON
+MSGPACK = MsgPack() if msgpack else None
+
+current_codec = contextvars.ContextVar("current_codec", default=STD_JSON)
+
+def negotiate(accept, fast=True):
+    """Chooses the codec for a request from its Accept header."""
+    if not fast:
+        return STD_JSON
+    if MSGPACK and accept:
+        for item in accept.split(","):
+            if item.partition(";")[0].strip().lower() in MSGPACK_TYPES:
+                return MSGPACK
+    return FAST_JSON
+
+class Negotiation:
+    """ASGI middleware that sets the codec for each request (app.add_middleware(Negotiation, fast=...))."""
+
+    def __init__(self, app, fast=True):
+        self.app = app
+        self.fast = fast
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = current_codec.set(negotiate(Headers(scope=scope).get("accept"), self.fast))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_codec.reset(token)
+
+class JSONResponse(StarletteJSONResponse):
+    """JSONResponse rendered with the request's negotiated codec (JSON unless the client asked for msgpack)."""
+
+    def render(self, content):
+        codec = current_codec.get()
+        self.media_type = codec.media_type
+        return codec.dumps(content)
+
+    def init_headers(self, headers=None):
+        super().init_headers(headers)
+        if MSGPACK:
+            self.headers.add_vary_header("Accept")
@@ -0,0 +1,99 @@
+# key_algorithms.py
+# Per-file key algorithms for the KMS. Every algorithm produces base64 PEM
+# key pairs and "wraps" small secrets (the AES key and IV) for the holder of
+# the private key:
+#
+#   rsa-2048      RSA-OAEP with SHA-256 (the original scheme)
+#   ecies-p256    ECIES on NIST P-256
+#   ecies-x25519  ECIES on Curve25519
+#
+# ECIES envelope: u16 length | ephemeral public key (SubjectPublicKeyInfo DER)
+# | 12-byte nonce | AES-256-GCM ciphertext | 16-byte tag. The AES key is
+# HKDF-SHA256(ECDH shared secret, info="cryspy-ecies:<algorithm>" + ephemeral DER).
+import base64
+import struct
+from Crypto.Cipher import AES, PKCS1_OAEP
+from Crypto.Hash import SHA256
+from Crypto.Protocol.DH import key_agreement
+from Crypto.Protocol.KDF import HKDF
+from Crypto.PublicKey import ECC, RSA
+from Crypto.Random import get_random_bytes
+
+DEFAULT_ALGORITHM = "rsa-2048"
+
+class RSAOAEP:
+    name = "rsa-2048"
+
+    def generate(self):
+        rsa_key = RSA.generate(2048)
+        pub = base64.b64encode(rsa_key.publickey().export_key()).decode()
+        priv = base64.b64encode(rsa_key.export_key()).decode()
+        return pub, priv
+
+    def wrap(self, pub_b64, data):
+        return PKCS1_OAEP.new(RSA.import_key(base64.b64decode(pub_b64)), hashAlgo=SHA256).encrypt(data)
+
+    def load(self, priv_b64):
+        """Returns an object whose decrypt(wrapped) recovers the secret."""
+        return PKCS1_OAEP.new(RSA.import_key(base64.b64decode(priv_b64)), hashAlgo=SHA256)
+
+class ECIES:
+    def __init__(self, name, curve):
+        self.name = name
+        self.curve = curve
+        self.info = f"cryspy-ecies:{name}".encode()
+
+    def generate(self):
+        key = ECC.generate(curve=self.curve)
+        pub = base64.b64encode(key.public_key().export_key(format='PEM').encode()).decode()
+        priv = base64.b64encode(key.export_key(format='PEM', use_pkcs8=True).encode()).decode()
+        return pub, priv
+
+    def _derive(self, priv, pub, eph_der):
+        # The ephemeral key is passed as a "static" key so one call covers both directions
+        shared = key_agreement(static_priv=priv, static_pub=pub, kdf=lambda z: z)
+        return HKDF(shared, 32, b"", SHA256, context=self.info + eph_der)
+
+    def wrap(self, pub_b64, data):
+        recipient = ECC.import_key(base64.b64decode(pub_b64))
+        eph = ECC.generate(curve=self.curve)
+        eph_der = eph.public_key().export_key(format='DER')
+        nonce = get_random_bytes(12)
+        cipher = AES.new(self._derive(eph, recipient, eph_der), AES.MODE_GCM, nonce=nonce)
+        ciphertext, tag = cipher.encrypt_and_digest(data)
+        return struct.pack(">H", len(eph_der)) + eph_der + nonce + ciphertext + tag
+
+    def load(self, priv_b64):
+        return ECIESDecryptor(self, ECC.import_key(base64.b64decode(priv_b64)))
+
+class ECIESDecryptor:
+    def __init__(self, algorithm, key):
+        self.algorithm = algorithm
+        self.key = key
+
+    def decrypt(self, envelope):
+        if len(envelope) < 2:
+            raise ValueError("Envelope too short")
+        (der_len,) = struct.unpack(">H", envelope[:2])
+        eph_der = envelope[2:2 + der_len]
+        nonce = envelope[2 + der_len:14 + der_len]
+        ciphertext, tag = envelope[14 + der_len:-16], envelope[-16:]
+        if len(nonce) != 12 or len(envelope) < 30 + der_len:
+            raise ValueError("Envelope too short")
+        eph = ECC.import_key(eph_der)
+        if eph.curve != self.key.curve:
+            raise ValueError("Ephemeral key is on the wrong curve")
+        cipher = AES.new(self.algorithm._derive(self.key, eph, eph_der), AES.MODE_GCM, nonce=nonce)
+        return cipher.decrypt_and_verify(ciphertext, tag)
+
+ALGORITHMS = {
+    alg.name: alg for alg in (
+        RSAOAEP(),
+        ECIES("ecies-p256", "P-256"),
+        ECIES("ecies-x25519", "Curve25519"),
+    )
+}
+
+def get_algorithm(name):
+    """Looks up an algorithm; records written before algorithms existed are RSA."""
+    return ALGORITHMS.get(name or DEFAULT_ALGORITHM)
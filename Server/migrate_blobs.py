@@ -0,0 +1,96 @@
+# migrate_blobs.py
+# Moves file contents out of Redis into the configured blob store
+# (BLOB_BACKEND / BLOB_DIR, as for the Data Server). Handles both older
+# layouts of filedata:{name}:
+#
+#   - an inline base64 "encrypted_data" field
+#   - "blobs" that live in blob:{id} Redis keys
+#
+# Each record is switched to the new manifest with a script that first checks
+# the record is unchanged, so it is safe to run while the Data Server serves
+# traffic, and to re-run after an interruption. blob:{id} keys are deleted once
+# every record using them has been moved.
+#
+#   BLOB_BACKEND=fs BLOB_DIR=./blobs python3 ./migrate_blobs.py
+from dotenv import load_dotenv
+from redis import asyncio as aioredis
+import asyncio
+import base64
+import os
+from blob_store import BLOB_REFS, BLOB_STAGING, RedisBlobStore, make_blob_store, manifest_digest
+
+BATCH = 1000
+
+# KEYS: filedata:{name}, blob_refs, blob_staging
+# ARGV: field holding the old layout ("encrypted_data" | "blobs"), its old value, new blobs, new sizes, digest
+# -> 1 migrated | 0 record changed or gone
+REPLACE_LUA = """
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then
+  return 0
+end
+local total = 0
+for size in string.gmatch(ARGV[4], '%d+') do
+  total = total + tonumber(size)
+end
+if ARGV[1] == 'blobs' then
+  for old in string.gmatch(ARGV[2], '[^,]+') do
+    if redis.call('HINCRBY', KEYS[2], old, -1) <= 0 then
+      redis.call('HDEL', KEYS[2], old)
+    end
+  end
+else
+  redis.call('HDEL', KEYS[1], 'encrypted_data')
+end
+for new in string.gmatch(ARGV[3], '[^,]+') do
+  redis.call('HINCRBY', KEYS[2], new, 1)
+  redis.call('ZREM', KEYS[3], new)
+end
+redis.call('HSET', KEYS[1], 'blobs', ARGV[3], 'sizes', ARGV[4], 'size', total, 'digest', ARGV[5])
+return 1
+"""
+
+async def migrate():
+    load_dotenv()
+    r = aioredis.Redis(host=os.getenv('REDIS_HOST'), port=os.getenv('REDIS_PORT'), db=0)
+    backend = os.getenv('BLOB_BACKEND', 'fs')
+    store = make_blob_store(backend, r, os.getenv('BLOB_DIR', 'blobs'))
+    source = RedisBlobStore(r)
+    replace = r.register_script(REPLACE_LUA)
+    migrated = skipped = 0
+    copied, keep = set(), set()
+    try:
+        async for key in r.scan_iter(match="filedata:*", count=BATCH):
+            data, blobs, sizes = await r.hmget(key, ('encrypted_data', 'blobs', 'sizes'))
+            if data is not None:
+                writers = [await store.write_bytes(base64.b64decode(data))]
+                field, old = 'encrypted_data', data
+            elif blobs is not None and backend != 'redis':
+                ids = blobs.decode().split(',')
+                lengths = [int(n) for n in sizes.decode().split(',')]
+                if not await r.exists(f"blob:{ids[0]}"):
+                    # Already in the store
+                    continue
+                writers = [await store.write_stream(source.read(blob_id, 0, n - 1))
+                           for blob_id, n in zip(ids, lengths)]
+                field, old = 'blobs', blobs
+                copied.update(ids)
+            else:
+                continue
+            new_ids = [w.blob_id for w in writers]
+            new_sizes = ",".join(str(w.size) for w in writers)
+            if await replace(keys=[key, BLOB_REFS, BLOB_STAGING],
+                             args=[field, old, ",".join(new_ids), new_sizes, manifest_digest(new_ids)]):
+                migrated += 1
+            else:
+                # Written blobs stay staged and are swept by the Data Server
+                skipped += 1
+                if field == 'blobs':
+                    keep.update(ids)
+        for blob_id in copied - keep:
+            await r.unlink(f"blob:{blob_id}")
+    finally:
+        await r.close()
+    print(f"[MIGRATE] Moved {migrated} files to the {backend} blob store ({skipped} changed during migration, skipped)")
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
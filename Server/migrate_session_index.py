@@ -0,0 +1,46 @@
+# migrate_session_index.py
+# One-shot conversion of user_sessions:{email} from a set of sids to the
+# sorted set the KMS now keeps (each sid scored by the Unix time its session
+# expires). Sids whose session:{sid} is already gone are dropped. Run it with
+# the KMS stopped: the old and new versions use different commands on the key.
+#
+#   python3 ./migrate_session_index.py
+from dotenv import load_dotenv
+from redis import asyncio as aioredis
+import asyncio
+import os
+import time
+
+BATCH = 1000
+
+async def migrate():
+    load_dotenv()
+    r = aioredis.Redis(host=os.getenv('REDIS_HOST'), port=os.getenv('REDIS_PORT'), db=0)
+    users = kept = dropped = 0
+    try:
+        async for key in r.scan_iter(match="user_sessions:*", count=BATCH):
+            if await r.type(key) != b"set":
+                continue
+            sids = [sid async for sid in r.sscan_iter(key, count=BATCH)]
+            async with r.pipeline(transaction=False) as pipe:
+                for sid in sids:
+                    pipe.ttl(f"session:{sid.decode()}")
+                pipe.ttl(key)
+                *ttls, index_ttl = await pipe.execute()
+            now = int(time.time())
+            alive = {sid: now + ttl for sid, ttl in zip(sids, ttls) if ttl > 0}
+            async with r.pipeline(transaction=True) as pipe:
+                pipe.delete(key)
+                if alive:
+                    pipe.zadd(key, alive)
+                    pipe.expire(key, max(max(ttls), index_ttl))
+                await pipe.execute()
+            users += 1
+            kept += len(alive)
+            dropped += len(sids) - len(alive)
+    finally:
+        await r.close()
+    print(f"[MIGRATE] Converted {users} session indexes, kept {kept} sessions, dropped {dropped} expired")
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
@@ -0,0 +1,193 @@
+# session_tokens.py
+# Signed session tokens shared by the KMS and the Data Server.
+#
+# A token is "<payload>.<signature>": payload is base64url JSON
+# {"e": email, "i": issued_at_ms, "x": expiry, "j": token_id} and signature is
+# HMAC-SHA256 of the payload with SESSION_SECRET, so any service holding the
+# secret verifies tokens in-process. Revocations are kept in Redis and mirrored
+# into a local bloom filter; only bloom hits cost a Redis round trip.
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import math
+import secrets
+import time
+
+REVOKED_TOKENS = "revoked_tokens"     # zset: token id -> expiry
+REVOKED_USERS = "revoked_users"       # hash: email -> tokens issued at or before this ms are revoked
+REVOCATION_CHANNEL = "revocations"    # pub/sub: "jti:<id>" / "user:<email>"
+
+def _b64e(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+def _b64d(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+class BloomFilter:
+    def __init__(self, capacity=100000, error_rate=0.001):
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+class SessionTokens:
+    """Issues and verifies signed session tokens.
+
+    `r` is a redis.asyncio client used only for revocations. `start()` keeps
+    the local bloom filter in sync: it follows the revocation channel and
+    rebuilds the filter from Redis every `refresh` seconds, pruning expired
+    entries.
+    """
+
+    def __init__(self, secret, r, ttl, refresh=60, capacity=100000, log=print):
+        if not secret:
+            raise RuntimeError("SESSION_SECRET must be set to use signed session tokens")
+        self.secret = secret.encode()
+        self.r = r
+        self.ttl = ttl
+        self.refresh = refresh
+        self.capacity = capacity
+        self.log = log
+        self.bloom = BloomFilter(capacity)
+        self.task = None
+        self.verified = 0
+        self.rejected = 0
+        self.bloom_hits = 0
+
+    def _sign(self, payload):
+        return _b64e(hmac.new(self.secret, payload.encode(), hashlib.sha256).digest())
+
+    def issue(self, email):
+        now = time.time()
+        claims = {"e": email, "i": int(now * 1000), "x": int(now) + self.ttl, "j": secrets.token_urlsafe(12)}
+        payload = _b64e(json.dumps(claims, separators=(",", ":")).encode())
+        return f"{payload}.{self._sign(payload)}"
+
+    def decode(self, token):
+        """Check signature and expiry without any I/O; returns the claims or None."""
+        if not token or "." not in token:
+            return None
+        payload, sig = token.rsplit(".", 1)
+        if not hmac.compare_digest(sig.encode(), self._sign(payload).encode()):
+            return None
+        try:
+            claims = json.loads(_b64d(payload))
+        except ValueError:
+            return None
+        if claims.get("x", 0) <= time.time():
+            return None
+        return claims
+
+    async def verify(self, token):
+        """Returns the token's email, or None if it is invalid, expired or revoked."""
+        claims = self.decode(token)
+        if claims is None:
+            self.rejected += 1
+            return None
+        if f"jti:{claims['j']}" in self.bloom or f"user:{claims['e']}" in self.bloom:
+            self.bloom_hits += 1
+            if await self._is_revoked(claims):
+                self.rejected += 1
+                return None
+        self.verified += 1
+        return claims["e"]
+
+    async def _is_revoked(self, claims):
+        async with self.r.pipeline(transaction=False) as pipe:
+            pipe.zscore(REVOKED_TOKENS, claims["j"])
+            pipe.hget(REVOKED_USERS, claims["e"])
+            expiry, before = await pipe.execute()
+        return expiry is not None or (before is not None and claims["i"] <= int(before))
+
+    async def revoke(self, token):
+        claims = self.decode(token)
+        if claims is None:
+            return False
+        async with self.r.pipeline(transaction=True) as pipe:
+            pipe.zadd(REVOKED_TOKENS, {claims["j"]: claims["x"]})
+            pipe.publish(REVOCATION_CHANNEL, f"jti:{claims['j']}")
+            await pipe.execute()
+        self.bloom.add(f"jti:{claims['j']}")
+        return True
+
+    async def revoke_user(self, email):
+        async with self.r.pipeline(transaction=True) as pipe:
+            pipe.hset(REVOKED_USERS, email, int(time.time() * 1000))
+            pipe.publish(REVOCATION_CHANNEL, f"user:{email}")
+            await pipe.execute()
+        self.bloom.add(f"user:{email}")
+
+    async def _rebuild(self):
+        now = time.time()
+        async with self.r.pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(REVOKED_TOKENS, "-inf", int(now))
+            pipe.zrange(REVOKED_TOKENS, 0, -1)
+            pipe.hgetall(REVOKED_USERS)
+            _, jtis, users = await pipe.execute()
+        bloom = BloomFilter(max(self.capacity, 2 * (len(jtis) + len(users))))
+        for jti in jtis:
+            bloom.add(f"jti:{jti.decode()}")
+        # A user revocation only matters while tokens issued before it can still be alive
+        horizon = int((now - self.ttl) * 1000)
+        stale = []
+        for email, before in users.items():
+            if int(before) < horizon:
+                stale.append(email)
+            else:
+                bloom.add(f"user:{email.decode()}")
+        if stale:
+            await self.r.hdel(REVOKED_USERS, *stale)
+        self.bloom = bloom
+
+    async def _sync_loop(self):
+        while True:
+            try:
+                async with self.r.pubsub() as pubsub:
+                    # Subscribe before the first rebuild so no revocation slips between them
+                    await pubsub.subscribe(REVOCATION_CHANNEL)
+                    next_rebuild = 0
+                    while True:
+                        if time.monotonic() >= next_rebuild:
+                            await self._rebuild()
+                            next_rebuild = time.monotonic() + self.refresh
+                        msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                        if msg:
+                            self.bloom.add(msg["data"].decode())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log(f"[SESSION] Revocation sync failed: {e!r}")
+                await asyncio.sleep(1)
+
+    def start(self):
+        self.task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self):
+        return {
+            "verified": self.verified,
+            "rejected": self.rejected,
+            "bloom_hits": self.bloom_hits,
+            "bloom_bits": self.bloom.size,
+        }